@@ -0,0 +1,115 @@
+"""
+Compares the concurrent request throughput of the sync and gevent worker modes on a synthetic model of a packet request
+    Run from the project root with `python benchmarks/async_workers.py`. Requires gunicorn and gevent, plus psycopg2 and
+    psycogreen when BENCH_DATABASE_URI is set.
+
+This doesn't run packet itself (its pages need OIDC and LDAP), so the numbers show how each worker mode handles the
+kinds of waits a packet page makes, not how fast packet is. Each request to the stand-in app below makes the same three
+waits as a packet page:
+    DB: With BENCH_DATABASE_URI set to a Postgres database, a real `SELECT pg_sleep()` through psycopg2, which yields
+        under gevent only because of the psycogreen patch in gunicorn.conf.py. Otherwise it's modeled with time.sleep.
+    LDAP: A sleep that ignores gevent's patching, like python-ldap's C code, run through the thread pool the same way
+          packet.concurrency.run_blocking does.
+    Outbound HTTP: A socket wait that gevent's monkey patching makes yield, modeled with time.sleep.
+"""
+
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen
+
+DATABASE_URI = os.environ.get('BENCH_DATABASE_URI')
+DB_LATENCY = float(os.environ.get('BENCH_DB_LATENCY', '0.05'))
+LDAP_LATENCY = float(os.environ.get('BENCH_LDAP_LATENCY', '0.1'))
+HTTP_LATENCY = float(os.environ.get('BENCH_HTTP_LATENCY', '0.1'))
+
+REQUESTS = int(os.environ.get('BENCH_REQUESTS', '200'))
+CONCURRENCY = int(os.environ.get('BENCH_CONCURRENCY', '50'))
+WORKERS = os.environ.get('BENCH_WORKERS', '2')
+
+
+def _run_blocking(func, *args):
+    try:
+        from gevent import monkey
+        if monkey.is_module_patched('socket'):
+            import gevent
+            return gevent.get_hub().threadpool.apply(func, args)
+    except ImportError:
+        pass
+
+    return func(*args)
+
+
+def _ldap_call(latency):
+    # A sleep that ignores gevent's patching, like a call into a C extension
+    try:
+        from gevent import monkey
+        monkey.get_original('time', 'sleep')(latency)
+    except ImportError:
+        time.sleep(latency)
+
+
+def _db_call(latency):
+    if not DATABASE_URI:
+        time.sleep(latency)
+        return
+
+    import psycopg2
+    connection = psycopg2.connect(DATABASE_URI)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_sleep(%s)', (latency,))
+    finally:
+        connection.close()
+
+
+def app(environ, start_response):
+    _db_call(DB_LATENCY)
+    _run_blocking(_ldap_call, LDAP_LATENCY)
+    time.sleep(HTTP_LATENCY)
+
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return [b'ok']
+
+
+def _benchmark(worker_class, port):
+    server = subprocess.Popen(['gunicorn', 'async_workers:app', '--chdir', os.path.dirname(os.path.abspath(__file__)),
+                               '--config', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                                                        'gunicorn.conf.py'),
+                               '--bind', '127.0.0.1:{}'.format(port), '--access-logfile', '/dev/null'],
+                              env=dict(os.environ, PACKET_WORKER_CLASS=worker_class, PACKET_WORKERS=WORKERS),
+                              stderr=subprocess.DEVNULL)
+    try:
+        url = 'http://127.0.0.1:{}/'.format(port)
+        for _ in range(50):
+            try:
+                urlopen(url).read()
+                break
+            except OSError:
+                time.sleep(0.2)
+
+        def timed_request(_):
+            start = time.perf_counter()
+            urlopen(url, timeout=120).read()
+            return time.perf_counter() - start
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(CONCURRENCY) as pool:
+            latencies = sorted(pool.map(timed_request, range(REQUESTS)))
+        elapsed = time.perf_counter() - start
+
+        print('{:>6}: {:7.1f} req/s, p50 {:6.3f}s, p95 {:6.3f}s'.format(
+            worker_class, REQUESTS / elapsed, latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.95)]))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    print('{} requests, {} concurrent, {} workers, injected latency: db={}s ({}) ldap={}s http={}s'.format(
+        REQUESTS, CONCURRENCY, WORKERS, DB_LATENCY, 'pg_sleep' if DATABASE_URI else 'modeled', LDAP_LATENCY,
+        HTTP_LATENCY))
+    for index, mode in enumerate(sys.argv[1:] or ['sync', 'gevent']):
+        _benchmark(mode, 18080 + index)
@@ -0,0 +1,155 @@
+"""
+Measures how the hot signature queries scale with the number of past seasons in the DB
+    Run from the project root with `BENCH_DATABASE_URI=postgresql://... python benchmarks/season_history.py`. The
+    database must be a scratch one: its schema is dropped and rebuilt for every step. Set BENCH_PARTITION=0 to stop the
+    migrations before the partitioning one for comparison.
+
+For each step the schema is built by the app's migrations and the seasons are created oldest first the way
+`flask create-packets` does, each getting its partitions from partitions.create_season_partitions(), so the open season
+is the newest one. Then the app's own queries are timed: Packet.open_packets() with its selectin signature loads, the
+signature matrix rebuild behind the member totals, and the season refresh behind the leaderboard. With the packet.end
+index and the season partitions their latency should stay flat as history grows.
+"""
+
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+DATABASE_URI = os.environ.get('BENCH_DATABASE_URI')
+PARTITIONED = os.environ.get('BENCH_PARTITION', '1') == '1'
+STEPS = [int(step) for step in os.environ.get('BENCH_SEASONS', '1,5,10,20').split(',')]
+PACKETS = int(os.environ.get('BENCH_PACKETS', '60'))
+UPPERCLASSMEN = int(os.environ.get('BENCH_UPPERCLASSMEN', '250'))
+ONFLOOR = int(os.environ.get('BENCH_ONFLOOR', '30'))
+MISC = int(os.environ.get('BENCH_MISC', '20'))
+REPEATS = int(os.environ.get('BENCH_REPEATS', '20'))
+
+if not DATABASE_URI:
+    sys.exit('Set BENCH_DATABASE_URI to a scratch Postgres database, the migrations only run on Postgres')
+
+# The app reads its database from the environment when it's imported
+os.environ['PACKET_DATABASE_URI'] = DATABASE_URI
+
+# pylint: disable=wrong-import-position
+from flask_migrate import upgrade
+
+from packet import app, db
+from packet.analytics import refresh_seasons, top_signers
+from packet.models import Freshman, Packet, UpperSignature, FreshSignature, MiscSignature
+from packet.partitions import create_season_partitions, is_partitioned
+from packet.sigmatrix import MatrixState, SignatureMatrix
+
+# The revision before the partitioning migration
+_UNPARTITIONED_REVISION = 'b4c91e7d0a36'
+
+
+def _reset_schema():
+    db.session.close()
+    db.session.execute('DROP SCHEMA public CASCADE')
+    db.session.execute('CREATE SCHEMA public')
+    db.session.commit()
+    upgrade(revision='head' if PARTITIONED else _UNPARTITIONED_REVISION)
+
+
+def _add_season(start):
+    """
+    Creates a season of packets the way create-packets does, starting with its partitions
+    """
+    create_season_partitions(start.date())
+
+    packets = [Packet(freshman_username='f{}'.format(index), start=start, end=start + timedelta(days=14))
+               for index in range(PACKETS)]
+    db.session.add_all(packets)
+    db.session.flush()
+
+    db.session.bulk_insert_mappings(UpperSignature, [
+        {'packet_id': packet.id, 'member': 'u{}'.format(member), 'signed': random.random() < 0.6, 'updated': start}
+        for packet in packets for member in range(UPPERCLASSMEN)])
+    db.session.bulk_insert_mappings(FreshSignature, [
+        {'packet_id': packet.id, 'freshman_username': 'f{}'.format(freshman), 'signed': random.random() < 0.8,
+         'updated': start} for packet in packets for freshman in range(ONFLOOR)])
+    db.session.bulk_insert_mappings(MiscSignature, [
+        {'packet_id': packet.id, 'member': 'm{}'.format(member), 'updated': start}
+        for packet in packets for member in range(MISC)])
+    db.session.commit()
+
+
+def _build(seasons, open_start):
+    """
+    Rebuilds the DB with the given number of seasons, the last of which is open and started at open_start
+    """
+    _reset_schema()
+    db.session.add_all(Freshman(rit_username='f{}'.format(index), name='Freshman {}'.format(index),
+                                onfloor=index < ONFLOOR) for index in range(max(PACKETS, ONFLOOR)))
+    db.session.commit()
+
+    for age in reversed(range(seasons)):
+        # Past seasons are a year apart
+        _add_season(open_start - timedelta(days=365 * age))
+
+    db.session.execute('ANALYZE')
+    db.session.commit()
+
+
+def _leaderboard(season):
+    refresh_seasons({season})
+    top_signers(season)
+    top_signers(season, freshmen=True)
+
+
+def _queries(season):
+    """
+    :return: A dict of query names to functions running them against the given open season
+    """
+    return {
+        'open packets': Packet.open_packets,
+        # pylint: disable=protected-access
+        'member totals': lambda: MatrixState.load(SignatureMatrix._open_packet_ids()).member_totals(),
+        'leaderboard': lambda: _leaderboard(season),
+    }
+
+
+def _time_queries(queries):
+    """
+    :return: A dict of query names to their average latency in milliseconds
+    """
+    timings = {}
+    for name, query in queries.items():
+        elapsed = 0
+        for _ in range(REPEATS):
+            begin = time.perf_counter()
+            query()
+            elapsed += time.perf_counter() - begin
+            # Drops the loaded objects and the leaderboard's rewritten stats rows
+            db.session.rollback()
+        timings[name] = elapsed / REPEATS * 1000
+    return timings
+
+
+def main():
+    open_start = datetime.now() - timedelta(days=2)
+    queries = _queries(open_start.date())
+    # The matrix logs every rebuild
+    app.logger.disabled = True
+
+    with app.app_context():
+        print('{} packets per season'.format(PACKETS))
+        print('{:>8} {:>12} {:>10}  {}'.format('seasons', 'partitioned', 'sig rows',
+                                               '  '.join('{:>14}'.format(name) for name in queries)))
+
+        for seasons in STEPS:
+            _build(seasons, open_start)
+            rows = sum(db.session.execute('SELECT count(*) FROM ' + table).scalar()
+                       for table in ('signature_upper', 'signature_fresh', 'signature_misc'))
+            timings = _time_queries(queries)
+            print('{:>8} {:>12} {:>10}  {}'.format(seasons, str(is_partitioned()), rows,
+                                                     '  '.join('{:>11.2f} ms'.format(timings[name])
+                                                               for name in queries)))
+
+
+if __name__ == '__main__':
+    main()
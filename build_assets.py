@@ -0,0 +1,91 @@
+"""
+Build step that fingerprints and precompresses the static assets
+    Run after `gulp production` with `python3 build_assets.py`. See the readme for details.
+
+Every file in packet/static is copied into packet/static/dist under a name containing a hash of its contents, along with
+.gz and .br variants for text based files. The mapping of original names to fingerprinted ones is written to
+packet/static/dist/assets.json, which packet.static_assets uses to rewrite url_for('static', ...) and to serve the
+precompressed files. This script intentionally doesn't import the app so it can run without any secrets.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'packet', 'static')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST_NAME = 'assets.json'
+
+# Files with these extensions are worth compressing. Images and fonts are already compressed.
+COMPRESSIBLE = ('.css', '.js', '.json', '.svg', '.xml', '.txt', '.html', '.ico', '.map', '.webmanifest')
+
+
+def _fingerprinted_name(path, contents):
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, hashlib.sha256(contents).hexdigest()[:12], ext)
+
+
+def _write_variants(dist_path, contents):
+    """
+    Writes the compressed variants of a file if they're smaller than the original
+    :return: The list of extensions written
+    """
+    written = []
+
+    compressed = gzip.compress(contents, compresslevel=9, mtime=0)
+    if len(compressed) < len(contents):
+        with open(dist_path + '.gz', 'wb') as out_file:
+            out_file.write(compressed)
+        written.append('.gz')
+
+    if brotli is not None:
+        compressed = brotli.compress(contents, quality=11)
+        if len(compressed) < len(contents):
+            with open(dist_path + '.br', 'wb') as out_file:
+                out_file.write(compressed)
+            written.append('.br')
+
+    return written
+
+
+def build():
+    if os.path.exists(DIST_DIR):
+        shutil.rmtree(DIST_DIR)
+
+    manifest = {}
+    for dir_path, dir_names, file_names in os.walk(STATIC_DIR):
+        if os.path.realpath(dir_path) == os.path.realpath(STATIC_DIR) and 'dist' in dir_names:
+            dir_names.remove('dist')
+
+        for file_name in file_names:
+            src_path = os.path.join(dir_path, file_name)
+            rel_path = os.path.relpath(src_path, STATIC_DIR).replace(os.sep, '/')
+
+            with open(src_path, 'rb') as src_file:
+                contents = src_file.read()
+
+            dist_rel_path = _fingerprinted_name(rel_path, contents)
+            dist_path = os.path.join(DIST_DIR, dist_rel_path)
+            os.makedirs(os.path.dirname(dist_path), exist_ok=True)
+            with open(dist_path, 'wb') as dist_file:
+                dist_file.write(contents)
+
+            variants = _write_variants(dist_path, contents) if rel_path.endswith(COMPRESSIBLE) else []
+            manifest[rel_path] = {'path': 'dist/' + dist_rel_path, 'encodings': variants}
+            print('{} -> {} {}'.format(rel_path, dist_rel_path, ' '.join(variants)))
+
+    with open(os.path.join(DIST_DIR, MANIFEST_NAME), 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    print('Built {} assets{}'.format(len(manifest), '' if brotli else ' (brotli not installed, skipped .br)'))
+
+
+if __name__ == '__main__':
+    build()
@@ -28,9 +28,44 @@ OIDC_CLIENT_SECRET = environ.get("PACKET_OIDC_CLIENT_SECRET", "PLEASE_REPLACE_ME
 SQLALCHEMY_DATABASE_URI = environ.get("PACKET_DATABASE_URI", None)
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Optional comma separated read replica URIs. Reads stay on the primary for REPLICA_STICKY_SECONDS after a user writes.
+SQLALCHEMY_REPLICA_URIS = [uri for uri in environ.get("PACKET_DATABASE_REPLICA_URIS", "").split(",") if uri]
+REPLICA_STICKY_SECONDS = int(environ.get("PACKET_REPLICA_STICKY_SECONDS", "10"))
+
+# Cache config
+CACHE_BACKEND = environ.get("PACKET_CACHE_BACKEND", "memory")
+# Defaults to packet-cache.sqlite3 in the instance folder. Created readable only by the app's user.
+CACHE_PATH = environ.get("PACKET_CACHE_PATH", None)
+CACHE_TTL = int(environ.get("PACKET_CACHE_TTL", "3600"))
+
+# Compiled templates are cached here. Defaults to a directory under the system temp dir.
+JINJA_BYTECODE_CACHE_DIR = environ.get("PACKET_JINJA_BYTECODE_CACHE_DIR", None)
+
+# Response compression config
+COMPRESSION_CACHE_BYTES = int(environ.get("PACKET_COMPRESSION_CACHE_BYTES", str(32 * 1024 * 1024)))
+COMPRESSION_MIN_SIZE = int(environ.get("PACKET_COMPRESSION_MIN_SIZE", "500"))
+
+# Profiling config
+PROFILE_ADMINS = [username for username in environ.get("PACKET_PROFILE_ADMINS", "").split(",") if username]
+PROFILE_RATE = float(environ.get("PACKET_PROFILE_RATE", "0"))
+PROFILE_MODE = environ.get("PACKET_PROFILE_MODE", "sample")
+# Defaults to profiles/ in the instance folder. Must only be accessible by the app's user.
+PROFILE_DIR = environ.get("PACKET_PROFILE_DIR", None)
+PROFILE_MAX_FILES = int(environ.get("PACKET_PROFILE_MAX_FILES", "50"))
+
+# Slow request capture config. A threshold of 0 disables capturing.
+SLOW_REQUEST_THRESHOLD = float(environ.get("PACKET_SLOW_REQUEST_THRESHOLD", "2"))
+SLOW_REQUEST_EXPLAIN = int(environ.get("PACKET_SLOW_REQUEST_EXPLAIN", "3"))
+SLOW_REQUEST_EXPLAIN_ANALYZE = strtobool(environ.get("PACKET_SLOW_REQUEST_EXPLAIN_ANALYZE", "False"))
+# Defaults to packet-slow-requests.sqlite3 in the instance folder. Created readable only by the app's user.
+SLOW_REQUEST_PATH = environ.get("PACKET_SLOW_REQUEST_PATH", None)
+SLOW_REQUEST_BUFFER = int(environ.get("PACKET_SLOW_REQUEST_BUFFER", "100"))
+
 # LDAP config
 LDAP_BIND_DN = environ.get("PACKET_LDAP_BIND_DN", None)
 LDAP_BIND_PASS = environ.get("PACKET_LDAP_BIND_PASS", None)
+LDAP_POOL_SIZE = int(environ.get("PACKET_LDAP_POOL_SIZE", "4"))
+LDAP_POOL_TIMEOUT = int(environ.get("PACKET_LDAP_POOL_TIMEOUT", "10"))
 
 # Mail Config
 MAIL_PROD = strtobool(environ.get("PACKET_MAIL_PROD", "False"))
@@ -46,6 +81,13 @@ ONESIGNAL_CSH_APP_ID = environ.get("PACKET_ONESIGNAL_CSH_APP_ID", "6eff123a-0852
 ONESIGNAL_INTRO_APP_AUTH_KEY = environ.get("PACKET_ONESIGNAL_INTRO_APP_AUTH_KEY", None)
 ONESIGNAL_INTRO_APP_ID = environ.get("PACKET_ONESIGNAL_INTRO_APP_ID", "6eff123a-0852-4027-804e-723044756f00")
 
+# Max tokens per OneSignal request and the number of requests a broadcast sends at once
+ONESIGNAL_CHUNK_SIZE = int(environ.get("PACKET_ONESIGNAL_CHUNK_SIZE", "2000"))
+ONESIGNAL_FANOUT_WORKERS = int(environ.get("PACKET_ONESIGNAL_FANOUT_WORKERS", "4"))
+
+# Seconds to wait for more signatures before sending a freshman a "your packet was signed" push (0 disables batching)
+NOTIFICATION_COALESCE_WINDOW = float(environ.get("PACKET_NOTIFICATION_COALESCE_WINDOW", "30"))
+
 # Slack URL for pushing to #general
 SLACK_WEBHOOK_URL = environ.get("PACKET_SLACK_URL", None)
 
@@ -0,0 +1,36 @@
+"""
+Gunicorn configuration for packet
+    Use with `gunicorn packet:app --config=gunicorn.conf.py`. See the readme for details on the worker modes.
+"""
+from os import environ
+
+bind = environ.get('PACKET_BIND', '0.0.0.0:8080')
+accesslog = '-'
+
+# Either "sync" or "gevent"
+worker_class = environ.get('PACKET_WORKER_CLASS', 'sync')
+workers = int(environ.get('PACKET_WORKERS', '2'))
+
+# Only used by the gevent worker. Each connection is handled by its own greenlet.
+worker_connections = int(environ.get('PACKET_WORKER_CONNECTIONS', '100'))
+
+# Size of the native thread pool that runs blocking LDAP calls in gevent workers
+ldap_threads = int(environ.get('PACKET_LDAP_THREADS', '10'))
+
+# Sync workers can spend a long time waiting on LDAP so they need a generous timeout. Gevent workers keep heartbeating
+# while requests wait so the default is enough for them.
+timeout = int(environ.get('PACKET_WORKER_TIMEOUT', '600' if worker_class == 'sync' else '30'))
+
+
+def post_fork(server, worker):
+    if worker_class != 'gevent':
+        return
+
+    # Make psycopg2 wait on the gevent hub rather than blocking the worker
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+    import gevent
+    gevent.get_hub().threadpool.maxsize = ldap_threads
+
+    server.log.info('Worker {} running in gevent mode'.format(worker.pid))
@@ -0,0 +1,80 @@
+"""Partition the signature tables by season
+
+Revision ID: c2d8f4a61e95
+Revises: b4c91e7d0a36
+Create Date: 2026-10-19 01:12:38.915520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2d8f4a61e95'
+down_revision = 'b4c91e7d0a36'
+branch_labels = None
+depends_on = None
+
+# Table names to their primary key columns and extra foreign keys. Must match packet.models.
+TABLES = (
+    ('signature_upper', 'packet_id, member', ()),
+    ('signature_fresh', 'packet_id, freshman_username', (('freshman_username', 'freshman (rit_username)'),)),
+    ('signature_misc', 'packet_id, member', ()),
+)
+
+
+def _create_like(table, source, primary_key, foreign_keys, partitioned):
+    op.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS){}'.format(
+        table, source, ' PARTITION BY RANGE (packet_id)' if partitioned else ''))
+    op.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(table, primary_key))
+    for column, reference in (('packet_id', 'packet (id)'),) + foreign_keys:
+        op.execute('ALTER TABLE {} ADD FOREIGN KEY ({}) REFERENCES {}'.format(table, column, reference))
+
+
+def _copy(table, source):
+    op.execute('INSERT INTO {} SELECT * FROM {}'.format(table, source))
+    op.execute('DROP TABLE {}'.format(source))
+
+
+def upgrade():
+    # Finding the open packets shouldn't scan every past season
+    op.create_index(op.f('ix_packet_end'), 'packet', ['end'], unique=False)
+
+    # Partitioning is Postgres only. Elsewhere the signature tables' primary keys, which lead with packet_id, already
+    # keep the lookups of the open packets' signatures from touching other seasons' rows.
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    # The first packet id of each season, oldest first. The last season's partition is open ended.
+    starts = op.get_bind().execute('SELECT min(id), min(start) FROM packet GROUP BY CAST(start AS DATE) '
+                                   'ORDER BY min(id)').fetchall()
+
+    for table, primary_key, foreign_keys in TABLES:
+        old = table + '_unpartitioned'
+        op.execute('ALTER TABLE {} RENAME TO {}'.format(table, old))
+        op.execute('ALTER TABLE {} RENAME CONSTRAINT {}_pkey TO {}_pkey'.format(old, table, old))
+        _create_like(table, old, primary_key, foreign_keys, True)
+
+        if not starts:
+            op.execute('CREATE TABLE {}_p0 PARTITION OF {} FOR VALUES FROM (MINVALUE) TO (MAXVALUE)'.format(
+                table, table))
+        for index, (first_id, start) in enumerate(starts):
+            lower = 'MINVALUE' if index == 0 else first_id
+            upper = starts[index + 1][0] if index + 1 < len(starts) else 'MAXVALUE'
+            op.execute('CREATE TABLE {}_p{} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+                table, start.strftime('%Y%m%d'), table, lower, upper))
+
+        _copy(table, old)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for table, primary_key, foreign_keys in TABLES:
+            old = table + '_partitioned'
+            op.execute('ALTER TABLE {} RENAME TO {}'.format(table, old))
+            op.execute('ALTER TABLE {} RENAME CONSTRAINT {}_pkey TO {}_pkey'.format(old, table, old))
+            _create_like(table, old, primary_key, foreign_keys, False)
+            # Dropping the partitioned table drops its partitions
+            _copy(table, old)
+
+    op.drop_index(op.f('ix_packet_end'), table_name='packet')
@@ -0,0 +1,42 @@
+"""Store upperclassman roles as a bitmask
+
+Revision ID: e5b9a0d4c613
+Revises: c71f0d35e8a2
+Create Date: 2026-10-18 22:05:11.402817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b9a0d4c613'
+down_revision = 'c71f0d35e8a2'
+branch_labels = None
+depends_on = None
+
+# Column names to their bits in roles. Must match the ROLE_* constants in packet.models.
+ROLE_BITS = (('active_rtp', 1), ('three_da', 2), ('webmaster', 4), ('c_m', 8), ('drink_admin', 16))
+
+
+def upgrade():
+    op.add_column('signature_upper', sa.Column('roles', sa.Integer(), nullable=False, server_default='0'))
+
+    op.execute('UPDATE signature_upper SET roles = ' + ' + '.join(
+        'CASE WHEN {} THEN {} ELSE 0 END'.format(column, bit) for column, bit in ROLE_BITS))
+
+    with op.batch_alter_table('signature_upper') as batch_op:
+        for column, _ in ROLE_BITS:
+            batch_op.drop_column(column)
+
+
+def downgrade():
+    with op.batch_alter_table('signature_upper') as batch_op:
+        for column, _ in ROLE_BITS:
+            batch_op.add_column(sa.Column(column, sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    for column, bit in ROLE_BITS:
+        op.execute('UPDATE signature_upper SET {} = (roles & {}) != 0'.format(column, bit))
+
+    with op.batch_alter_table('signature_upper') as batch_op:
+        batch_op.drop_column('roles')
@@ -9,14 +9,15 @@ import json
 import csh_ldap
 import onesignal
 from flask import Flask
-from flask_gzip import Gzip
 from flask_migrate import Migrate
 from flask_pyoidc.flask_pyoidc import OIDCAuthentication
 from flask_pyoidc.provider_configuration import ProviderConfiguration, ClientMetadata
-from flask_sqlalchemy import SQLAlchemy
+from jinja2 import FileSystemBytecodeCache
+
+from .db_routing import RoutingSQLAlchemy
+from .ldap_pool import LDAPPool
 
 app = Flask(__name__)
-gzip = Gzip(app)
 
 # Load default configuration and any environment variable overrides
 _root_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -31,13 +32,16 @@ if os.path.exists(_pyfile_config):
 with open(os.path.join(_root_dir, 'package.json')) as package_file:
     app.config['VERSION'] = json.load(package_file)['version']
 
+# Share compiled templates between workers and restarts
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
 # Logger configuration
 logging.getLogger().setLevel(app.config['LOG_LEVEL'])
 app.logger.info('Launching packet v' + app.config['VERSION'])
 app.logger.info('Using the {} realm'.format(app.config['REALM']))
 
 # Initialize the extensions
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 app.logger.info('SQLAlchemy pointed at ' + repr(db.engine.url))
 
@@ -58,13 +62,18 @@ intro_onesignal_client = onesignal.Client(user_auth_key=app.config['ONESIGNAL_US
 auth = OIDCAuthentication({'app': APP_CONFIG}, app)
 
 # LDAP
-_ldap = csh_ldap.CSHLDAP(app.config['LDAP_BIND_DN'], app.config['LDAP_BIND_PASS'])
+_ldap_pool = LDAPPool(lambda: csh_ldap.CSHLDAP(app.config['LDAP_BIND_DN'], app.config['LDAP_BIND_PASS']),
+                      size=app.config['LDAP_POOL_SIZE'], timeout=app.config['LDAP_POOL_TIMEOUT'])
+_ldap_pool.warm()
 
 app.logger.info('OIDCAuth and LDAP configured')
 
 # pylint: disable=wrong-import-position
 from . import models
 from . import context_processors
+from . import static_assets
+from . import compression
+from . import profiling
 from . import commands
 from .routes import api, shared
 
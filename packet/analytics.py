@@ -0,0 +1,216 @@
+"""
+Maintenance and querying of the season analytics tables
+
+The sign paths keep the tables up to date incrementally while the CLI commands that restructure signatures refresh the
+seasons they touch. Reads only ever hit the small summary tables so they stay fast no matter how much history exists.
+"""
+
+from datetime import date, datetime
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .models import Packet, UpperSignature, FreshSignature, MiscSignature, SeasonStats, DailyStats, \
+    MemberSeasonStats, PacketArchive
+from .partitions import packet_id_range
+from .scoring import scores_from_db
+
+# Maps signature types to the SeasonStats column holding their count
+_season_columns = {
+    'upper': 'upper_signatures',
+    'fresh': 'fresh_signatures',
+    'misc': 'misc_signatures',
+}
+
+
+def season_of(packet):
+    """
+    :return: The key used to group the given packet into a season
+    """
+    return _as_date(packet.start)
+
+
+def _as_date(value):
+    """
+    Normalizes the values returned by func.date() and DateTime columns across DB backends
+    """
+    if isinstance(value, str):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    elif isinstance(value, datetime):
+        return value.date()
+    else:
+        return value
+
+
+def _increment(model, key, column, delta, **values):
+    """
+    Adds delta to the given column of the stats row identified by key, creating the row if needed
+    """
+    row = model.query.filter_by(**key).first()
+
+    if row is None:
+        row = model(**key, **values)
+        for counter in filter(lambda col: col.type.python_type is int, model.__table__.columns):
+            setattr(row, counter.name, 0)
+        setattr(row, column, delta)
+        try:
+            # In a savepoint so losing the race to create the row only undoes this insert, not the caller's changes
+            with db.session.begin_nested():
+                db.session.add(row)
+            return
+        except IntegrityError:
+            row = model.query.filter_by(**key).one()
+
+    # Let the DB do the addition so concurrent workers don't lose updates
+    setattr(row, column, getattr(model, column) + delta)
+    for name, value in values.items():
+        setattr(row, name, value)
+
+
+def record_signature(packet, username, sig_type, delta=1, day=None):
+    """
+    Updates the stats for a signature being added to (delta=1) or removed from (delta=-1) a packet. The caller is
+    responsible for committing.
+    :param sig_type: One of 'upper', 'fresh', or 'misc'
+    :param day: The day the signature was originally made. Defaults to today.
+    """
+    season = season_of(packet)
+
+    _increment(SeasonStats, {'season': season}, _season_columns[sig_type], delta)
+    _increment(DailyStats, {'season': season, 'day': day or date.today()}, 'signatures', delta)
+    _increment(MemberSeasonStats, {'season': season, 'member': username}, 'signatures', delta,
+               freshman=sig_type == 'fresh')
+
+
+def record_completion(packet, delta=1):
+    """
+    Updates the completed packet count for the season of a packet that just reached (or dropped below) 100%
+    """
+    _increment(SeasonStats, {'season': season_of(packet)}, 'completed', delta)
+
+
+def refresh_seasons(seasons):
+    """
+    Recomputes the stats rows for the given seasons from the signature tables. The caller is responsible for committing.
+    :param seasons: An iterable of season keys as returned by season_of()
+    """
+    seasons = set(seasons)
+    if not seasons:
+        return
+
+    packet_seasons = {packet_id: _as_date(start) for packet_id, start in db.session.query(Packet.id, Packet.start)
+                      if _as_date(start) in seasons}
+    packet_ids = list(packet_seasons)
+
+    for model in (SeasonStats, DailyStats, MemberSeasonStats):
+        model.query.filter(model.season.in_(seasons)).delete(synchronize_session=False)
+
+    season_stats = {season: SeasonStats(season=season, packets=0, completed=0, upper_signatures=0,
+                                        fresh_signatures=0, misc_signatures=0) for season in seasons}
+    if packet_ids:
+        _refresh_season_totals(season_stats, packet_seasons, packet_ids)
+        _refresh_daily(packet_ids)
+        _refresh_members(packet_ids)
+
+    for stats in filter(lambda stats: stats.packets > 0, season_stats.values()):
+        db.session.add(stats)
+
+
+def _refresh_season_totals(season_stats, packet_seasons, packet_ids):
+    scores = scores_from_db(packet_ids)
+
+    for index, packet_id in enumerate(scores.packet_ids):
+        stats = season_stats[packet_seasons[packet_id]]
+        stats.packets += 1
+        stats.upper_signatures += int(scores.upper_received[index])
+        stats.fresh_signatures += int(scores.fresh_received[index])
+        stats.misc_signatures += int(scores.misc_received[index])
+        stats.completed += int(scores.is_100[index])
+
+
+def _refresh_daily(packet_ids):
+    daily = {}
+
+    for sig_model in (UpperSignature, FreshSignature, MiscSignature):
+        query = db.session.query(Packet.start, func.date(sig_model.updated), func.count()) \
+            .join(sig_model, sig_model.packet_id == Packet.id) \
+            .filter(Packet.id.in_(packet_ids), packet_id_range(sig_model.packet_id, packet_ids))
+        if sig_model is not MiscSignature:
+            query = query.filter(sig_model.signed)
+
+        for start, day, signatures in query.group_by(Packet.start, func.date(sig_model.updated)):
+            key = (_as_date(start), _as_date(day))
+            daily[key] = daily.get(key, 0) + signatures
+
+    for (season, day), signatures in daily.items():
+        db.session.add(DailyStats(season=season, day=day, signatures=signatures))
+
+
+def _refresh_members(packet_ids):
+    members = {}
+
+    for sig_model, username_col in ((UpperSignature, UpperSignature.member), (MiscSignature, MiscSignature.member),
+                                    (FreshSignature, FreshSignature.freshman_username)):
+        query = db.session.query(Packet.start, username_col, func.count()) \
+            .join(sig_model, sig_model.packet_id == Packet.id) \
+            .filter(Packet.id.in_(packet_ids), packet_id_range(sig_model.packet_id, packet_ids))
+        if sig_model is not MiscSignature:
+            query = query.filter(sig_model.signed)
+
+        for start, username, signatures in query.group_by(Packet.start, username_col):
+            key = (_as_date(start), username)
+            members[key] = (members.get(key, (0, False))[0] + signatures, sig_model is FreshSignature)
+
+    for (season, username), (signatures, freshman) in members.items():
+        db.session.add(MemberSeasonStats(season=season, member=username, freshman=freshman, signatures=signatures))
+
+
+def archived_seasons():
+    """
+    :return: The set of seasons whose signatures have been moved to PacketArchives
+    """
+    return {_as_date(start) for start, in db.session.query(Packet.start).distinct()
+            .join(PacketArchive, PacketArchive.packet_id == Packet.id)}
+
+
+def rebuild_analytics():
+    """
+    Drops and recomputes every stats row. Archived seasons keep their rows since their signatures aren't in the
+    signature tables anymore. The caller is responsible for committing.
+    :return: The number of seasons rebuilt
+    """
+    archived = archived_seasons()
+    seasons = {_as_date(start) for start, in db.session.query(Packet.start).distinct()} - archived
+
+    for model in (SeasonStats, DailyStats, MemberSeasonStats):
+        query = model.query.filter(~model.season.in_(archived)) if archived else model.query
+        query.delete(synchronize_session=False)
+
+    refresh_seasons(seasons)
+    return len(seasons)
+
+
+# Readers
+
+def season_summaries():
+    """
+    :return: A list of SeasonStats instances, newest season first
+    """
+    return SeasonStats.query.order_by(SeasonStats.season.desc()).all()
+
+
+def daily_signatures(season):
+    """
+    :return: A list of (day, signatures) tuples for the given season in chronological order
+    """
+    return [(row.day, row.signatures) for row in DailyStats.query.filter_by(season=season).order_by(DailyStats.day)]
+
+
+def top_signers(season, freshmen=False, limit=10):
+    """
+    :return: A list of (username, signatures) tuples for the members (or freshmen) who signed the most packets
+    """
+    query = MemberSeasonStats.query.filter_by(season=season, freshman=freshmen) \
+        .order_by(MemberSeasonStats.signatures.desc()).limit(limit)
+    return [(row.member, row.signatures) for row in query]
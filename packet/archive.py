@@ -0,0 +1,88 @@
+"""
+Moving closed seasons out of the signature tables
+
+Archiving a season packs each of its packets' signature rows into a single compressed PacketArchive row and deletes them
+from the signature tables, so the hot tables and their indexes only hold the seasons that can still change. Archived
+packets are read from their PacketSnapshot like any other closed packet, PacketArchive.unpack() gives back the original
+rows as model instances, and restoring a season reinserts them unchanged.
+"""
+
+from datetime import datetime
+
+from . import db
+from .analytics import _as_date
+from .models import Packet, PacketArchive, UpperSignature, FreshSignature, MiscSignature
+from .snapshots import snapshot_closed_packets
+
+# The number of packets archived or restored per batch of queries
+_BATCH_SIZE = 200
+
+
+def season_packets(season):
+    """
+    :return: A list of the ids of the given season's packets and whether any of them haven't ended yet
+    """
+    now = datetime.now()
+    packets = [(packet_id, end) for packet_id, start, end in db.session.query(Packet.id, Packet.start, Packet.end)
+               if _as_date(start) == season]
+    return [packet_id for packet_id, _ in packets], any(end > now for _, end in packets)
+
+
+def _batches(packet_ids):
+    for start in range(0, len(packet_ids), _BATCH_SIZE):
+        yield packet_ids[start:start + _BATCH_SIZE]
+
+
+def archive_packets(packet_ids):
+    """
+    Moves the signature rows of the given closed packets into PacketArchives. The caller is responsible for committing.
+    :return: The number of signature rows archived
+    """
+    # Archived packets are always read from their snapshot
+    snapshot_closed_packets()
+
+    archived = {packet_id for packet_id, in db.session.query(PacketArchive.packet_id)
+                .filter(PacketArchive.packet_id.in_(packet_ids))} if packet_ids else set()
+    rows = 0
+
+    for batch in _batches([packet_id for packet_id in packet_ids if packet_id not in archived]):
+        signatures = {packet_id: ([], [], []) for packet_id in batch}
+        for index, sig_model in enumerate((UpperSignature, FreshSignature, MiscSignature)):
+            for sig in sig_model.query.filter(sig_model.packet_id.in_(batch)).order_by(sig_model.updated):
+                signatures[sig.packet_id][index].append(sig)
+                rows += 1
+
+        db.session.add_all(PacketArchive.pack(packet_id, *sigs) for packet_id, sigs in signatures.items())
+        for sig_model in (UpperSignature, FreshSignature, MiscSignature):
+            sig_model.query.filter(sig_model.packet_id.in_(batch)).delete(synchronize_session=False)
+
+        # The loaded signatures would otherwise stay in the session until the commit
+        db.session.flush()
+        db.session.expunge_all()
+
+    return rows
+
+
+def restore_packets(packet_ids):
+    """
+    Moves the signature rows of the given packets out of their PacketArchives. The caller is responsible for committing.
+    :return: The number of signature rows restored
+    """
+    rows = 0
+
+    for batch in _batches(list(packet_ids)):
+        values = {UpperSignature: [], FreshSignature: [], MiscSignature: []}
+        for archive in PacketArchive.query.filter(PacketArchive.packet_id.in_(batch)):
+            for sigs in archive.unpack():
+                for sig in sigs:
+                    values[type(sig)].append({column.name: getattr(sig, column.name)
+                                              for column in sig.__table__.columns})
+
+        for sig_model, sig_values in values.items():
+            if sig_values:
+                db.session.execute(sig_model.__table__.insert(), sig_values)
+                rows += len(sig_values)
+
+        PacketArchive.query.filter(PacketArchive.packet_id.in_(batch)).delete(synchronize_session=False)
+
+    return rows
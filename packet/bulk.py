@@ -0,0 +1,245 @@
+"""
+Bulk signature changes
+
+Operations are validated against the open packets and their current signature rows with one query per chunk of
+operations, then simulated in order so an operation sees the effect of the ones before it. Only the net change to each
+signature is written, using one set-based statement per kind of change (chunked to stay under SQLite's parameter
+limit), along with an event for every operation that did something.
+"""
+
+import csv
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import literal, null, tuple_, union_all, true
+
+from . import db
+from .analytics import _as_date
+from .models import Packet, UpperSignature, FreshSignature, MiscSignature, SignatureEvent
+
+ACTIONS = ('sign', 'unsign')
+TYPES = ('member', 'freshman')
+
+# Keeps the number of bound parameters per statement under SQLite's limit
+_CHUNK_SIZE = 400
+
+# An operation binds up to 5 parameters in the validation query (its packet id plus its upper and misc pairs)
+_VALIDATION_CHUNK_SIZE = _CHUNK_SIZE // 5
+
+Operation = namedtuple('Operation', ['line', 'action', 'packet_id', 'username', 'is_member'])
+Result = namedtuple('Result', ['line', 'description', 'status', 'message'])
+
+
+def _describe(record):
+    return '{} {} {} on packet {}'.format(record.get('action'), record.get('type'), record.get('username'),
+                                          record.get('packet_id'))
+
+
+def parse_operation(line, record):
+    """
+    :param record: A dict with action, packet_id, username, and type keys
+    :return: An Operation
+    :raises ValueError: If the record isn't a valid operation
+    """
+    action = str(record.get('action') or '').strip().lower()
+    sig_type = str(record.get('type') or '').strip().lower()
+    username = str(record.get('username') or '').strip()
+
+    if action not in ACTIONS:
+        raise ValueError('action must be one of {}'.format(', '.join(ACTIONS)))
+    if sig_type not in TYPES:
+        raise ValueError('type must be one of {}'.format(', '.join(TYPES)))
+    if not username:
+        raise ValueError('username is required')
+    try:
+        packet_id = int(record.get('packet_id'))
+    except (TypeError, ValueError):
+        raise ValueError('packet_id must be an integer')
+
+    return Operation(line, action, packet_id, username, sig_type == 'member')
+
+
+def read_operations(path):
+    """
+    Reads a CSV file with an action,packet_id,username,type header or an NDJSON file with one object per line
+    :return: A tuple of the valid Operations and the Results for the records that couldn't be parsed
+    """
+    with open(path, newline='') as operations_file:
+        content = operations_file.read()
+
+    records, invalid = [], []
+    if path.endswith(('.ndjson', '.jsonl', '.json')) or content.lstrip().startswith('{'):
+        for line, text in enumerate(content.splitlines(), 1):
+            if not text.strip():
+                continue
+            try:
+                records.append((line, json.loads(text)))
+            except ValueError as error:
+                invalid.append(Result(line, text.strip()[:50], 'error', 'invalid JSON: {}'.format(error)))
+    else:
+        reader = csv.DictReader(content.splitlines())
+        records = [(reader.line_num, record) for record in reader]
+
+    operations = []
+    for line, record in records:
+        if not isinstance(record, dict):
+            invalid.append(Result(line, str(record)[:50], 'error', 'not a JSON object'))
+            continue
+        try:
+            operations.append(parse_operation(line, record))
+        except ValueError as error:
+            invalid.append(Result(line, _describe(record), 'error', str(error)))
+
+    return operations, invalid
+
+
+def _signature_state(operations):
+    """
+    Fetches the open packets and the signature rows the operations refer to, one query per chunk of operations
+    :return: A dict of open packet ids to start times and a dict of (sig_type, packet_id, username) to signed
+    """
+    now = datetime.now()
+    starts, rows = {}, {}
+
+    def signatures(model, sig_type, username, signed, pairs):
+        return db.session.query(literal(sig_type), model.packet_id, username, signed, null()) \
+            .filter(tuple_(model.packet_id, username).in_(pairs))
+
+    for chunk in _chunks(operations, _VALIDATION_CHUNK_SIZE):
+        packet_ids = {operation.packet_id for operation in chunk}
+        members = {(operation.packet_id, operation.username) for operation in chunk if operation.is_member}
+        freshmen = {(operation.packet_id, operation.username) for operation in chunk if not operation.is_member}
+
+        open_packets = db.session.query(literal('packet'), Packet.id, null(), null(), Packet.start) \
+            .filter(Packet.id.in_(packet_ids), Packet.start < now, Packet.end > now)
+        queries = [open_packets]
+        if members:
+            queries.append(signatures(UpperSignature, 'upper', UpperSignature.member, UpperSignature.signed, members))
+            queries.append(signatures(MiscSignature, 'misc', MiscSignature.member, true(), members))
+        if freshmen:
+            queries.append(signatures(FreshSignature, 'fresh', FreshSignature.freshman_username,
+                                      FreshSignature.signed, freshmen))
+
+        for kind, packet_id, username, signed, start in db.session.execute(union_all(*(query.subquery().select()
+                                                                                        for query in queries))):
+            if kind == 'packet':
+                starts[packet_id] = start
+            else:
+                rows[(kind, packet_id, username)] = bool(signed)
+
+    return starts, rows
+
+
+class BulkPlan:
+    """
+    The outcome of simulating a list of operations against the current signatures
+    """
+    def __init__(self, starts, rows):
+        self.starts = starts
+        self.original = dict(rows)
+        self.state = dict(rows)
+        self.results = []
+        # (packet_id, sig_type, username, action) for every operation that changed something
+        self.events = []
+
+    def _result(self, operation, status, message):
+        description = '{} {} {} on packet {}'.format(operation.action, 'member' if operation.is_member else 'freshman',
+                                                     operation.username, operation.packet_id)
+        self.results.append(Result(operation.line, description, status, message))
+
+    def _set(self, operation, key, signed):
+        if key[0] == 'misc':
+            if signed:
+                self.state[key] = True
+            else:
+                self.state.pop(key)
+        else:
+            self.state[key] = signed
+        self.events.append((operation.packet_id, key[0], operation.username, operation.action))
+        self._result(operation, 'applied', '{} signature {}ed'.format(key[0], operation.action))
+
+    def apply(self, operation):
+        """
+        Applies an operation to the simulated state and records its result
+        """
+        if operation.packet_id not in self.starts:
+            self._result(operation, 'error', 'packet does not exist or is not open')
+            return
+
+        signing = operation.action == 'sign'
+        if operation.is_member:
+            key = ('upper', operation.packet_id, operation.username)
+            if key not in self.state:
+                key = ('misc', operation.packet_id, operation.username)
+                if key not in self.state and signing:
+                    self._set(operation, key, True)
+                    return
+        else:
+            key = ('fresh', operation.packet_id, operation.username)
+            if key not in self.state:
+                self._result(operation, 'error', 'not an onfloor freshman on this packet')
+                return
+
+        if self.state.get(key, False) == signing:
+            self._result(operation, 'skipped', 'already signed' if signing else 'not signed')
+        else:
+            self._set(operation, key, signing)
+
+    def changes(self, sig_type, signed):
+        """
+        :return: A list of (packet_id, username) pairs whose signature of the given type ends up in the given state
+        """
+        return [key[1:] for key in set(self.original) | set(self.state) if key[0] == sig_type and
+                self.state.get(key, False) == signed and self.original.get(key, False) != signed]
+
+    def seasons(self):
+        """
+        :return: The seasons of the packets that changed
+        """
+        return {_as_date(self.starts[packet_id]) for packet_id, _, _, _ in self.events}
+
+
+def plan_operations(operations):
+    """
+    :return: A BulkPlan with the results of applying the operations in order
+    """
+    plan = BulkPlan(*_signature_state(operations)) if operations else BulkPlan({}, {})
+    for operation in operations:
+        plan.apply(operation)
+    return plan
+
+
+def _chunks(items, size=_CHUNK_SIZE):
+    for index in range(0, len(items), size):
+        yield items[index:index + size]
+
+
+def _update_signed(model, username, pairs, signed, now):
+    for chunk in _chunks(pairs):
+        db.session.execute(model.__table__.update().where(tuple_(model.packet_id, username).in_(chunk))
+                           .values(signed=signed, updated=now))
+
+
+def apply_plan(plan):
+    """
+    Writes a plan's net changes and events with set-based statements. The caller is responsible for updating the
+    analytics (ex. by refreshing plan.seasons()) and committing.
+    """
+    now = datetime.now()
+    for signed in (True, False):
+        _update_signed(UpperSignature, UpperSignature.member, plan.changes('upper', signed), signed, now)
+        _update_signed(FreshSignature, FreshSignature.freshman_username, plan.changes('fresh', signed), signed, now)
+
+    added = plan.changes('misc', True)
+    if added:
+        db.session.execute(MiscSignature.__table__.insert(),
+                           [{'packet_id': packet_id, 'member': member, 'updated': now} for packet_id, member in added])
+    for chunk in _chunks(plan.changes('misc', False)):
+        db.session.execute(MiscSignature.__table__.delete()
+                           .where(tuple_(MiscSignature.packet_id, MiscSignature.member).in_(chunk)))
+
+    if plan.events:
+        db.session.execute(SignatureEvent.__table__.insert(),
+                           [{'packet_id': packet_id, 'sig_type': sig_type, 'username': username, 'action': action,
+                             'created': now} for packet_id, sig_type, username, action in plan.events])
@@ -0,0 +1,300 @@
+"""
+Pluggable caching for the expensive lookup helpers
+
+Caches are declared with the cached() decorator, which is a drop-in replacement for functools.lru_cache that adds TTL
+expiry and a choice of backend. The memory backend is a per-process LRU. The sqlite backend stores entries as JSON in a
+local SQLite file so every worker on the host shares one warm copy without needing any outside services. The file must
+be owned by the app's user and not readable or writable by anyone else, otherwise the memory backend is used instead.
+
+Cache namespaces are prefixed with the data they depend on (ex. 'freshman:onfloor'). When a CLI command bumps that
+prefix's DataVersion every worker drops the matching caches on its next request, leaving the rest of them warm. The
+sqlite backend also records the version its entries were filled under, so entries left from before a restart or deploy
+are dropped by the first request of a new worker if the version has moved since.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import wraps
+
+from flask import request
+
+from . import app, db
+from .local_files import instance_path, private_file
+from .models import DataVersion
+
+# Matches the shape of functools.lru_cache's cache_info() so existing stats logging keeps working
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+class MemoryBackend:
+    """
+    Per-process LRU cache with optional TTL expiry
+    """
+    def __init__(self, namespace, maxsize, ttl):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        :return: A tuple of (found, value)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            value, expires = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.time() + self.ttl if self.ttl else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self, version=None):  # pylint: disable=unused-argument
+        with self._lock:
+            self._entries.clear()
+
+    def sync_version(self, version):
+        # Every process starts with an empty memory cache, so it can't hold entries from an older version
+        pass
+
+    def size(self):
+        return len(self._entries)
+
+
+def _encode(obj):
+    # Sets aren't JSON, so they're tagged to come back as frozensets
+    if isinstance(obj, (set, frozenset)):
+        return {'__frozenset__': sorted(obj)}
+    raise TypeError('{} values can\'t be cached'.format(type(obj).__name__))
+
+
+def _dumps(value):
+    return json.dumps(value, default=_encode)
+
+
+def _loads(value):
+    return json.loads(value, object_hook=lambda obj: frozenset(obj['__frozenset__']) if '__frozenset__' in obj
+                      else obj)
+
+
+class SQLiteBackend:
+    """
+    Host-wide cache shared by all workers through a SQLite file. Values must be JSON serializable or sets.
+    """
+    def __init__(self, namespace, maxsize, ttl, path):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self._local = threading.local()
+
+    def _con(self):
+        con = getattr(self._local, 'con', None)
+        if con is None:
+            con = self._local.con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            con.execute('CREATE TABLE IF NOT EXISTS cache (namespace TEXT, key TEXT, value BLOB, expires REAL, '
+                        'accessed REAL, PRIMARY KEY (namespace, key))')
+            con.execute('CREATE INDEX IF NOT EXISTS cache_lru ON cache (namespace, accessed)')
+            con.execute('CREATE TABLE IF NOT EXISTS cache_version (namespace TEXT PRIMARY KEY, version INTEGER)')
+        return con
+
+    def get(self, key):
+        """
+        :return: A tuple of (found, value)
+        """
+        con = self._con()
+        now = time.time()
+        row = con.execute('SELECT value, expires FROM cache WHERE namespace = ? AND key = ?',
+                          (self.namespace, key)).fetchone()
+        if row is None:
+            return False, None
+
+        if row[1] is not None and row[1] < now:
+            con.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (self.namespace, key))
+            return False, None
+
+        con.execute('UPDATE cache SET accessed = ? WHERE namespace = ? AND key = ?', (now, self.namespace, key))
+        return True, _loads(row[0])
+
+    def set(self, key, value):
+        con = self._con()
+        now = time.time()
+        con.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)',
+                    (self.namespace, key, _dumps(value), now + self.ttl if self.ttl else None, now))
+        con.execute('DELETE FROM cache WHERE namespace = ? AND key IN (SELECT key FROM cache WHERE namespace = ? '
+                    'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.namespace, self.namespace, self.maxsize))
+
+    def clear(self, version=None):
+        """
+        :param version: The DataVersion the entries filled from now on belong to
+        """
+        con = self._con()
+        con.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+        if version is not None:
+            con.execute('INSERT OR REPLACE INTO cache_version VALUES (?, ?)', (self.namespace, version))
+
+    def sync_version(self, version):
+        """
+        Drops the entries if they were filled under a DataVersion other than the given one
+        """
+        row = self._con().execute('SELECT version FROM cache_version WHERE namespace = ?',
+                                  (self.namespace,)).fetchone()
+        if row is None or row[0] != version:
+            self.clear(version)
+
+    def size(self):
+        return self._con().execute('SELECT count(*) FROM cache WHERE namespace = ?', (self.namespace,)).fetchone()[0]
+
+
+def cache_path():
+    """
+    :return: The configured CACHE_PATH, or a file in the app's instance folder
+    """
+    return instance_path(app.config['CACHE_PATH'], 'packet-cache.sqlite3')
+
+
+# Whether the sqlite backend's file passed private_file(), checked once per process
+_cache_file_ok = None
+
+
+def _create_backend(namespace, maxsize, ttl, shared):
+    global _cache_file_ok
+    if shared and app.config['CACHE_BACKEND'] == 'sqlite':
+        if _cache_file_ok is None:
+            _cache_file_ok = private_file(cache_path())
+        if _cache_file_ok:
+            return SQLiteBackend(namespace, maxsize, ttl, cache_path())
+
+    return MemoryBackend(namespace, maxsize, ttl)
+
+
+# All caches declared with cached() by namespace
+_caches = {}
+
+
+def cached(namespace, maxsize=128, ttl=None, shared=True):
+    """
+    Decorator for caching the results of a function by its arguments
+    :param namespace: A unique name for this cache
+    :param ttl: Seconds before an entry expires. Defaults to the CACHE_TTL config value.
+    :param shared: Set to False for functions that return values that can't be stored as JSON. These always use the
+                   memory backend.
+    """
+    def decorator(func):
+        state = {'backend': None, 'hits': 0, 'misses': 0}
+        lock = threading.Lock()
+
+        def backend():
+            if state['backend'] is None:
+                state['backend'] = _create_backend(namespace, maxsize, app.config['CACHE_TTL'] if ttl is None else ttl,
+                                                   shared)
+            return state['backend']
+
+        @wraps(func)
+        def wrapped_function(*args, **kwargs):
+            key = repr((args, sorted(kwargs.items())))
+
+            found, value = backend().get(key)
+            with lock:
+                state['hits' if found else 'misses'] += 1
+
+            if not found:
+                value = func(*args, **kwargs)
+                backend().set(key, value)
+
+            return value
+
+        def cache_info():
+            return CacheInfo(state['hits'], state['misses'], maxsize, backend().size())
+
+        def cache_clear(version=None):
+            backend().clear(version)
+
+        def cache_sync_version(version):
+            backend().sync_version(version)
+
+        wrapped_function.namespace = namespace
+        wrapped_function.cache_info = cache_info
+        wrapped_function.cache_clear = cache_clear
+        wrapped_function.cache_sync_version = cache_sync_version
+        _caches[namespace] = wrapped_function
+        return wrapped_function
+
+    return decorator
+
+
+def cache_stats():
+    """
+    :return: A dict of namespaces to the CacheInfo for each cache in this process
+    """
+    return {namespace: func.cache_info() for namespace, func in _caches.items()}
+
+
+# Callbacks to run when a DataVersion namespace changes, in addition to clearing the caches under that prefix
+_invalidation_callbacks = {}
+
+# The DataVersion stamps this process last saw
+_seen_versions = None
+
+
+def on_data_version_change(namespace, callback):
+    """
+    Registers a callback to run when the given DataVersion namespace is bumped
+    """
+    _invalidation_callbacks.setdefault(namespace, []).append(callback)
+
+
+def invalidate(namespace, version=None):
+    """
+    Clears every cache under the given prefix and runs its registered callbacks
+    :param version: The namespace's new DataVersion
+    """
+    for func in filter(lambda func: func.namespace.split(':')[0] == namespace, _caches.values()):
+        func.cache_clear(version)
+
+    for callback in _invalidation_callbacks.get(namespace, []):
+        callback()
+
+    app.logger.info('Invalidated cached {} data'.format(namespace))
+
+
+@app.before_request
+def check_data_versions():
+    """
+    Compares the DataVersion stamps with the ones seen by the previous request and drops the stale namespaces. A
+    process' first request compares them with the versions the shared caches were filled under instead.
+    """
+    global _seen_versions
+
+    if request.endpoint == 'static':
+        return
+
+    # Replicas lag by different amounts, so comparing stamps read from them could go backwards
+    with db.use_primary():
+        versions = DataVersion.current()
+    if _seen_versions is None:
+        # The shared caches may have been filled by workers that ran before this one started, under older versions
+        for func in _caches.values():
+            func.cache_sync_version(versions.get(func.namespace.split(':')[0], 0))
+    else:
+        for namespace in filter(lambda namespace: versions[namespace] != _seen_versions.get(namespace), versions):
+            invalidate(namespace, versions[namespace])
+
+    _seen_versions = versions
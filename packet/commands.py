@@ -5,15 +5,24 @@ Defines command-line utilities for use with packet
 from secrets import token_hex
 from datetime import datetime, time, timedelta
 import csv
+import json
+from collections import Counter
 import click
+from sqlalchemy.orm import lazyload
 
 from packet.mail import send_start_packet_mail
 from packet.notifications import packet_starting_notification, packets_starting_notification
 from . import app, db
-from .models import Freshman, Packet, FreshSignature, UpperSignature, MiscSignature
-from .ldap import ldap_get_eboard_role, ldap_get_active_rtps, ldap_get_3das, ldap_get_webmasters, \
-    ldap_get_drink_admins, ldap_get_constitutional_maintainers, ldap_is_intromember, ldap_get_active_members, \
-    ldap_is_on_coop
+from .db_routing import replica_reads
+from .bulk import read_operations, plan_operations, apply_plan
+from .projections import replay, compare_analytics, write_analytics
+from .slow_requests import slow_requests
+from .analytics import season_of, refresh_seasons, rebuild_analytics, record_signature, record_completion
+from .snapshots import score_packets, snapshot_closed_packets
+from .archive import season_packets, archive_packets, restore_packets
+from .partitions import create_season_partitions
+from .models import Freshman, Packet, FreshSignature, UpperSignature, MiscSignature, DataVersion, SignatureEvent
+from .ldap import ldap_prefetch_directory
 
 
 @app.cli.command('create-secret')
@@ -55,6 +64,19 @@ def input_date(prompt):
             pass
 
 
+def fetch_directory():
+    """
+    Prefetches the LDAP data used by the season commands, reporting how long it took
+    :return: A DirectorySnapshot
+    """
+    print('Fetching data from LDAP...')
+    start = datetime.now()
+    directory = ldap_prefetch_directory()
+    print('Fetched {} upperclassmen from LDAP in {} seconds'.format(len(directory.upper),
+                                                                     (datetime.now() - start).total_seconds()))
+    return directory
+
+
 @app.cli.command('sync-freshmen')
 @click.argument('freshmen_csv')
 def sync_freshmen(freshmen_csv):
@@ -82,11 +104,13 @@ def sync_freshmen(freshmen_csv):
         freshman.onfloor = False
 
     # Update the freshmen signatures of each open or future packet
-    for packet in Packet.query.filter(Packet.end > datetime.now()).all():
+    open_packets = Packet.query.filter(Packet.end > datetime.now()).all()
+    for packet in open_packets:
         # Handle the freshmen that are no longer onfloor
         for fresh_sig in filter(lambda fresh_sig: not fresh_sig.freshman.onfloor, packet.fresh_signatures):
             FreshSignature.query.filter_by(packet_id=fresh_sig.packet_id,
                                            freshman_username=fresh_sig.freshman_username).delete()
+            SignatureEvent.record(packet, 'fresh', fresh_sig.freshman_username, 'drop')
 
         # Add any new onfloor freshmen
         # pylint: disable=cell-var-from-loop
@@ -96,7 +120,10 @@ def sync_freshmen(freshmen_csv):
                                                         csv_freshman.rit_username != packet.freshman_username,
                                    freshmen_in_csv.values()):
             db.session.add(FreshSignature(packet=packet, freshman=freshmen_in_db[csv_freshman.rit_username]))
+            SignatureEvent.record(packet, 'fresh', csv_freshman.rit_username, 'require')
 
+    refresh_seasons(map(season_of, open_packets))
+    DataVersion.bump('freshman')
     db.session.commit()
     print('Done!')
 
@@ -116,15 +143,11 @@ def create_packets(freshmen_csv):
     start = datetime.combine(base_date, packet_start_time)
     end = datetime.combine(base_date, packet_end_time) + timedelta(days=14)
 
-    print('Fetching data from LDAP...')
-    all_upper = list(filter(
-        lambda member: not ldap_is_intromember(member) and not ldap_is_on_coop(member), ldap_get_active_members()))
+    directory = fetch_directory()
+    db_start = datetime.now()
 
-    rtp = ldap_get_active_rtps()
-    three_da = ldap_get_3das()
-    webmaster = ldap_get_webmasters()
-    c_m = ldap_get_constitutional_maintainers()
-    drink = ldap_get_drink_admins()
+    if create_season_partitions(start.date()) is not None:
+        print('Created the signature table partitions for the new season')
 
     # Packet starting notifications
     packets_starting_notification(start)
@@ -138,22 +161,21 @@ def create_packets(freshmen_csv):
         send_start_packet_mail(packet)
         packet_starting_notification(packet)
 
-        for member in all_upper:
-            sig = UpperSignature(packet=packet, member=member.uid)
-            sig.eboard = ldap_get_eboard_role(member)
-            sig.active_rtp = member.uid in rtp
-            sig.three_da = member.uid in three_da
-            sig.webmaster = member.uid in webmaster
-            sig.c_m = member.uid in c_m
-            sig.drink_admin = member.uid in drink
+        for member in directory.upper:
+            sig = UpperSignature(packet=packet, member=member)
+            directory.apply_roles(sig)
             db.session.add(sig)
+            SignatureEvent.record(packet, 'upper', member, 'require')
 
         for onfloor_freshman in Freshman.query.filter_by(onfloor=True).filter(Freshman.rit_username !=
                                                                               freshman.rit_username).all():
             db.session.add(FreshSignature(packet=packet, freshman=onfloor_freshman))
+            SignatureEvent.record(packet, 'fresh', onfloor_freshman.rit_username, 'require')
 
+    refresh_seasons([start.date()])
+    DataVersion.bump('packet')
     db.session.commit()
-    print('Done!')
+    print('Done! DB updates took {} seconds'.format((datetime.now() - db_start).total_seconds()))
 
 
 @app.cli.command('ldap-sync')
@@ -161,64 +183,86 @@ def ldap_sync():
     """
     Updates the upper and misc sigs in the DB to match ldap.
     """
-    print('Fetching data from LDAP...')
-    all_upper = {member.uid: member for member in filter(
-        lambda member: not ldap_is_intromember(member) and not ldap_is_on_coop(member), ldap_get_active_members())}
-
-    rtp = ldap_get_active_rtps()
-    three_da = ldap_get_3das()
-    webmaster = ldap_get_webmasters()
-    c_m = ldap_get_constitutional_maintainers()
-    drink = ldap_get_drink_admins()
+    directory = fetch_directory()
+    all_upper = set(directory.upper)
+    db_start = datetime.now()
 
     print('Applying updates to the DB...')
-    for packet in Packet.query.filter(Packet.end > datetime.now()).all():
+    open_packets = Packet.query.filter(Packet.end > datetime.now()).all()
+    for packet in open_packets:
         # Update the role state of all UpperSignatures
         for sig in filter(lambda sig: sig.member in all_upper, packet.upper_signatures):
-            sig.eboard = ldap_get_eboard_role(all_upper[sig.member])
-            sig.active_rtp = sig.member in rtp
-            sig.three_da = sig.member in three_da
-            sig.webmaster = sig.member in webmaster
-            sig.c_m = sig.member in c_m
-            sig.drink_admin = sig.member in drink
+            directory.apply_roles(sig)
 
         # Migrate UpperSignatures that are from accounts that are not active anymore
         for sig in filter(lambda sig: sig.member not in all_upper, packet.upper_signatures):
             UpperSignature.query.filter_by(packet_id=packet.id, member=sig.member).delete()
+            SignatureEvent.record(packet, 'upper', sig.member, 'drop')
             if sig.signed:
                 sig = MiscSignature(packet=packet, member=sig.member)
                 db.session.add(sig)
+                SignatureEvent.record(packet, 'misc', sig.member, 'sign')
 
         # Migrate MiscSignatures that are from accounts that are now active members
         for sig in filter(lambda sig: sig.member in all_upper, packet.misc_signatures):
             MiscSignature.query.filter_by(packet_id=packet.id, member=sig.member).delete()
+            SignatureEvent.record(packet, 'misc', sig.member, 'unsign')
             sig = UpperSignature(packet=packet, member=sig.member, signed=True)
-            sig.eboard = ldap_get_eboard_role(all_upper[sig.member])
-            sig.active_rtp = sig.member in rtp
-            sig.three_da = sig.member in three_da
-            sig.webmaster = sig.member in webmaster
-            sig.c_m = sig.member in c_m
-            sig.drink_admin = sig.member in drink
+            directory.apply_roles(sig)
             db.session.add(sig)
+            SignatureEvent.record(packet, 'upper', sig.member, 'require')
+            SignatureEvent.record(packet, 'upper', sig.member, 'sign')
 
         # Create UpperSignatures for any new active members
         # pylint: disable=cell-var-from-loop
         upper_sigs = set(map(lambda sig: sig.member, packet.upper_signatures))
         for member in filter(lambda member: member not in upper_sigs, all_upper):
             sig = UpperSignature(packet=packet, member=member)
-            sig.eboard = ldap_get_eboard_role(all_upper[sig.member])
-            sig.active_rtp = sig.member in rtp
-            sig.three_da = sig.member in three_da
-            sig.webmaster = sig.member in webmaster
-            sig.c_m = sig.member in c_m
-            sig.drink_admin = sig.member in drink
+            directory.apply_roles(sig)
             db.session.add(sig)
+            SignatureEvent.record(packet, 'upper', member, 'require')
 
+    refresh_seasons(map(season_of, open_packets))
+    DataVersion.bump('member')
     db.session.commit()
-    print('Done!')
+    print('Done! DB updates took {} seconds'.format((datetime.now() - db_start).total_seconds()))
+
+
+@app.cli.command('rebuild-analytics')
+def rebuild_analytics_cmd():
+    """
+    Recomputes the season analytics tables from the signature tables.
+    """
+    print('Rebuilding analytics...')
+    seasons = rebuild_analytics()
+    db.session.commit()
+    print('Rebuilt analytics for {} seasons'.format(seasons))
+
+
+@app.cli.command('replay-events')
+@click.option('--write', is_flag=True, help='Replace the analytics tables with the replayed totals')
+def replay_events(write):
+    """
+    Rebuilds the signature totals from the event log and compares them to the analytics tables.
+    """
+    start = datetime.now()
+    projection = replay()
+    print('Replayed {} events for {} packets in {} seconds'.format(projection.event_count, len(projection.packets),
+                                                                  (datetime.now() - start).total_seconds()))
+
+    differences = compare_analytics(projection)
+    for difference in differences:
+        print('\t' + difference)
+    print('{} differences from the analytics tables'.format(len(differences)))
+
+    if write:
+        write_analytics(projection)
+        db.session.commit()
+        print('Analytics tables replaced with the replayed totals')
 
 
 @app.cli.command('fetch-results')
+@replica_reads
 def fetch_results():
     """
     Fetches and prints the results from a given packet season.
@@ -226,16 +270,19 @@ def fetch_results():
     end_date = datetime.combine(input_date("Enter the last day of the packet season you'd like to retrieve results "
                                            'from'), packet_end_time)
 
-    for packet in Packet.query.filter_by(end=end_date).all():
+    packets = Packet.query.options(lazyload('*')).filter_by(end=end_date).all()
+    scores = score_packets(packet.id for packet in packets)
+
+    for index, packet in enumerate(packets):
         print()
 
         print('{} ({}):'.format(packet.freshman.name, packet.freshman.rit_username))
 
-        received = packet.signatures_received()
-        required = packet.signatures_required()
+        received = scores.received(index)
+        required = scores.required(index)
 
-        print('\tUpperclassmen score: {:0.2f}%'.format(received.member_total / required.member_total * 100))
-        print('\tTotal score: {:0.2f}%'.format(received.total / required.total * 100))
+        print('\tUpperclassmen score: {:0.2f}%'.format(scores.member_percent[index]))
+        print('\tTotal score: {:0.2f}%'.format(scores.total_percent[index]))
         print()
 
         print('\tUpperclassmen: {}/{}'.format(received.upper, required.upper))
@@ -246,6 +293,53 @@ def fetch_results():
         print('\tTotal missed:', required.total - received.total)
 
 
+@app.cli.command('close-packets')
+def close_packets():
+    """
+    Freezes the results of every packet that has ended. Run it from cron shortly after packets end.
+    """
+    start = datetime.now()
+    closed = snapshot_closed_packets()
+    db.session.commit()
+    print('Snapshotted {} packets in {} seconds'.format(closed, (datetime.now() - start).total_seconds()))
+
+
+@app.cli.command('archive-season')
+def archive_season():
+    """
+    Moves the signatures of a closed packet season out of the signature tables.
+    """
+    season = input_date('Enter the first day of the packet season to archive')
+    packet_ids, any_open = season_packets(season)
+    if not packet_ids:
+        print('There are no packets in that season')
+        return
+    elif any_open:
+        print("That season still has open packets so it can't be archived")
+        return
+
+    start = datetime.now()
+    rows = archive_packets(packet_ids)
+    db.session.commit()
+    print('Archived {} signatures from {} packets in {} seconds'.format(rows, len(packet_ids),
+                                                                       (datetime.now() - start).total_seconds()))
+
+
+@app.cli.command('restore-season')
+def restore_season():
+    """
+    Moves the signatures of an archived packet season back into the signature tables.
+    """
+    season = input_date('Enter the first day of the packet season to restore')
+    packet_ids, _ = season_packets(season)
+
+    start = datetime.now()
+    rows = restore_packets(packet_ids)
+    db.session.commit()
+    print('Restored {} signatures to {} packets in {} seconds'.format(rows, len(packet_ids),
+                                                                     (datetime.now() - start).total_seconds()))
+
+
 @app.cli.command('extend-packet')
 @click.argument('packet_id')
 def extend_packet(packet_id):
@@ -272,27 +366,41 @@ def remove_sig(packet_id, username, is_member):
     if not packet.is_open():
         print('Packet is already closed so its signatures cannot be modified')
         return
-    elif is_member:
+
+    was_100 = packet.is_100()
+    if is_member:
         sig = UpperSignature.query.filter_by(packet_id=packet_id, member=username).first()
         if sig is not None:
+            if sig.signed:
+                record_signature(packet, username, 'upper', -1, sig.updated.date())
+                SignatureEvent.record(packet, 'upper', username, 'unsign')
             sig.signed = False
-            db.session.commit()
-            print('Successfully unsigned packet')
         else:
-            result = MiscSignature.query.filter_by(packet_id=packet_id, member=username).delete()
-            if result == 1:
-                db.session.commit()
-                print('Successfully unsigned packet')
-            else:
+            sig = MiscSignature.query.filter_by(packet_id=packet_id, member=username).first()
+            if sig is None:
                 print('Failed to unsign packet; could not find signature')
+                return
+
+            record_signature(packet, username, 'misc', -1, sig.updated.date())
+            SignatureEvent.record(packet, 'misc', username, 'unsign')
+            packet.misc_signatures.remove(sig)
+            db.session.delete(sig)
     else:
         sig = FreshSignature.query.filter_by(packet_id=packet_id, freshman_username=username).first()
-        if sig is not None:
-            sig.signed = False
-            db.session.commit()
-            print('Successfully unsigned packet')
-        else:
+        if sig is None:
             print('Failed to unsign packet; {} is not an onfloor'.format(username))
+            return
+
+        if sig.signed:
+            record_signature(packet, username, 'fresh', -1, sig.updated.date())
+            SignatureEvent.record(packet, 'fresh', username, 'unsign')
+        sig.signed = False
+
+    if was_100 and not packet.is_100():
+        record_completion(packet, -1)
+
+    db.session.commit()
+    print('Successfully unsigned packet')
 
 
 @app.cli.command('remove-member-sig')
@@ -315,3 +423,72 @@ def remove_freshman_sig(packet_id, freshman):
     :param freshman: The freshman's RIT username
     """
     remove_sig(packet_id, freshman, False)
+
+
+@app.cli.command('bulk-sigs')
+@click.argument('operations_file')
+@click.option('--dry-run', is_flag=True, help='Report what each operation would do without changing anything')
+def bulk_sigs(operations_file, dry_run):
+    """
+    Signs or unsigns packets in bulk.
+    :param operations_file: A CSV file with an action,packet_id,username,type header or an NDJSON file with one
+                            {"action", "packet_id", "username", "type"} object per line. action is sign or unsign and
+                            type is member or freshman.
+    """
+    operations, invalid = read_operations(operations_file)
+    plan = plan_operations(operations)
+
+    applied = 'would apply' if dry_run else 'applied'
+    results = sorted(invalid + plan.results, key=lambda result: result.line)
+    for result in results:
+        print('line {}: {}: {} ({})'.format(result.line, result.description,
+                                            applied if result.status == 'applied' else result.status, result.message))
+
+    statuses = Counter(result.status for result in results)
+    print('{} {}, {} skipped, {} errors'.format(statuses['applied'], applied, statuses['skipped'], statuses['error']))
+
+    if dry_run:
+        print('Dry run, no changes were made')
+        return
+
+    apply_plan(plan)
+    refresh_seasons(plan.seasons())
+    db.session.commit()
+    print('Done!')
+
+
+@app.cli.command('slow-requests')
+@click.argument('record_id', required=False, type=int)
+@click.option('--limit', default=20, help='The number of recent records to list')
+def show_slow_requests(record_id, limit):
+    """
+    Lists recently captured slow requests, or shows the statements and query plans of the given one.
+    """
+    if record_id is None:
+        for record_id, record in slow_requests.recent(limit):
+            timing = record['timing']
+            print('{:>5}  {}  {:.3f}s total, {:.3f}s in {} statements  {} {}'.format(
+                record_id, record['recorded'], timing['total'], timing['sql'], timing['statements'], record['route'],
+                ', '.join('{}={}'.format(*argument) for argument in record['arguments'].items())))
+        return
+
+    record = slow_requests.get(record_id)
+    if record is None:
+        print('No slow request with id', record_id)
+        return
+
+    print(json.dumps({key: value for key, value in record.items() if key not in ('queries', 'plans')}, indent=2))
+    print()
+
+    print('Statements:')
+    for query in record['queries']:
+        print('\t{:.4f}s  {}'.format(query['seconds'], ' '.join(query['statement'].split())))
+        print('\t         {}'.format(query['parameters']))
+    print()
+
+    print('Query plans of the slowest statements:')
+    for plan in record['plans']:
+        print('\t{:.4f}s  {}'.format(plan['seconds'], ' '.join(plan['statement'].split())))
+        for line in plan['plan']:
+            print('\t\t' + line)
+        print()
@@ -0,0 +1,174 @@
+"""
+Compression for dynamic responses
+
+Most pages are rendered identically for everyone looking at them, so rather than compressing every response from
+scratch the compressed bodies are kept in a bounded LRU keyed by a hash of the uncompressed body. The same hash is sent
+as a weak ETag so browsers that already have the page get a 304 without anything being compressed at all.
+
+Static files are handled by packet.static_assets and are skipped here.
+"""
+
+import gzip
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import request
+
+from packet import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'text/plain', 'text/javascript', 'application/javascript',
+                          'application/json', 'image/svg+xml'}
+
+# Larger bodies get cheaper settings so a cache miss on a big page doesn't stall the request
+# (max size, gzip level, brotli quality)
+_LEVELS = ((16 * 1024, 9, 9), (256 * 1024, 6, 5), (None, 4, 4))
+
+
+def compression_levels(size):
+    """
+    :return: A tuple of (gzip level, brotli quality) for a body of the given size
+    """
+    for max_size, gzip_level, brotli_quality in _LEVELS:
+        if max_size is None or size <= max_size:
+            return gzip_level, brotli_quality
+
+
+def compress(data, encoding):
+    """
+    Compresses data with either 'br' or 'gzip'
+    """
+    gzip_level, brotli_quality = compression_levels(len(data))
+    if encoding == 'br':
+        return brotli.compress(data, quality=brotli_quality)
+    return gzip.compress(data, compresslevel=gzip_level, mtime=0)
+
+
+class CompressionCache:
+    """
+    LRU of compressed bodies bounded by their total size in bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.compress_time = 0.0
+
+    def get(self, digest, encoding, data):
+        """
+        :param digest: The hash of data
+        :return: A tuple of (compressed body, seconds spent compressing it)
+        """
+        key = (digest, encoding)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body, 0.0
+
+        start = time.perf_counter()
+        body = compress(data, encoding)
+        seconds = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.compress_time += seconds
+            if key not in self._entries and len(body) <= self.max_bytes:
+                self._entries[key] = body
+                self._bytes += len(body)
+                while self._bytes > self.max_bytes:
+                    self._bytes -= len(self._entries.popitem(last=False)[1])
+
+        return body, seconds
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        """
+        :return: A dict of utilization metrics
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'compress_time': round(self.compress_time, 3),
+            }
+
+
+_cache = CompressionCache(app.config['COMPRESSION_CACHE_BYTES'])
+
+
+def compression_stats():
+    """
+    :return: A dict of this process's compression cache metrics
+    """
+    return _cache.stats()
+
+
+def _accepted_encoding():
+    """
+    :return: The best encoding the client accepts, or None
+    """
+    if brotli is not None and 'br' in request.accept_encodings:
+        return 'br'
+    if 'gzip' in request.accept_encodings:
+        return 'gzip'
+    return None
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compresses the response body for clients that accept it, reusing a cached copy when the body hasn't changed
+    """
+    if request.endpoint == 'static' or response.status_code != 200 or response.direct_passthrough \
+            or response.is_streamed or 'Content-Encoding' in response.headers \
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['COMPRESSION_MIN_SIZE']:
+        return response
+
+    # Weak since the same ETag is shared by every encoding of the body
+    digest = hashlib.sha1(data).hexdigest()
+    response.set_etag(digest, weak=True)
+    response.vary.add('Accept-Encoding')
+
+    response.make_conditional(request)
+    if response.status_code == 304:
+        _cache.record_not_modified()
+        return response
+
+    encoding = _accepted_encoding()
+    if encoding is None:
+        return response
+
+    body, seconds = _cache.get(digest, encoding, data)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+
+    app.logger.debug('Compressed {} bytes to {} with {} in {:.2f}ms'.format(len(data), len(body), encoding,
+                                                                            seconds * 1000))
+    response.headers.add('Server-Timing', 'compress;dur={:.2f}'.format(seconds * 1000))
+
+    return response
@@ -0,0 +1,30 @@
+"""
+Helpers for keeping cooperative (gevent) workers responsive
+
+Under the gevent worker, sockets and the psycopg2 driver yield on their own (see gunicorn.conf.py) but python-ldap is a
+C extension that blocks the whole worker while it waits on the server. Blocking calls like that get pushed onto gevent's
+native thread pool so only the greenlet that made the call waits.
+"""
+
+
+def async_mode():
+    """
+    :return: True if running in a gevent monkey patched worker
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+
+    return monkey.is_module_patched('socket')
+
+
+def run_blocking(func, *args, **kwargs):
+    """
+    Calls func on gevent's thread pool when in async mode, otherwise it's a plain call
+    """
+    if async_mode():
+        import gevent
+        return gevent.get_hub().threadpool.apply(func, args, kwargs)
+
+    return func(*args, **kwargs)
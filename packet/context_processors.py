@@ -3,16 +3,17 @@ Context processors used by the jinja templates
 """
 import hashlib
 import urllib
-from functools import lru_cache
 from datetime import datetime
+from functools import lru_cache
 
+from packet.cache import cached
 from packet.ldap import ldap_get_member
-from packet.models import Freshman
+from packet.models import Freshman, ROLE_ACTIVE_RTP, ROLE_THREE_DA, ROLE_WEBMASTER, ROLE_C_M, ROLE_DRINK_ADMIN
 from packet import app
 
 
 # pylint: disable=bare-except
-@lru_cache(maxsize=128)
+@cached('member:csh_name')
 def get_csh_name(username):
     try:
         member = ldap_get_member(username)
@@ -21,39 +22,38 @@ def get_csh_name(username):
         return username
 
 
-def get_roles(sig):
+# Role bits in the order their badges are shown, with their badge class and label
+_ROLE_BADGES = ((ROLE_ACTIVE_RTP, 'rtp', 'RTP'), (ROLE_THREE_DA, 'three_da', '3DA'),
+                (ROLE_WEBMASTER, 'webmaster', 'Webmaster'), (ROLE_C_M, 'cm', 'Constitutional Maintainer'),
+                (ROLE_DRINK_ADMIN, 'drink', 'Drink Admin'))
+
+
+@lru_cache(maxsize=256)
+def role_badges(eboard, roles):
     """
-    Converts a signature's role fields to a dict for ease of access.
-    :return: A dictionary of role short names to role long names
+    Converts a signature's role fields to the badges shown next to the member's name. There are only a handful of
+    distinct combinations so each one is built once and shared by every row that has it.
+    :param eboard: UpperSignature.eboard
+    :param roles: UpperSignature.roles
+    :return: A tuple of (badge class, label) tuples
     """
-    out = {}
-    if sig.eboard:
-        out['eboard'] = sig.eboard
-    if sig.active_rtp:
-        out['rtp'] = 'RTP'
-    if sig.three_da:
-        out['three_da'] = '3DA'
-    if sig.webmaster:
-        out['webmaster'] = 'Webmaster'
-    if sig.c_m:
-        out['cm'] = 'Constitutional Maintainer'
-    if sig.drink_admin:
-        out['drink'] = 'Drink Admin'
-    return out
+    badges = [('eboard', eboard)] if eboard else []
+    badges.extend((badge, label) for bit, badge, label in _ROLE_BADGES if roles & bit)
+    return tuple(badges)
 
 
 # pylint: disable=bare-except
-@lru_cache(maxsize=128)
+@cached('freshman:rit_name')
 def get_rit_name(username):
     try:
-        freshman = Freshman.query.filter_by(rit_username=username).first()
+        freshman = Freshman.by_username(username)
         return freshman.name + ' (' + username + ')'
     except:
         return username
 
 
 # pylint: disable=bare-except
-@lru_cache(maxsize=128)
+@cached('gravatar:rit_image', ttl=24 * 60 * 60)
 def get_rit_image(username):
     if username:
         addresses = [username + '@rit.edu', username + '@g.rit.edu']
@@ -79,5 +79,5 @@ def log_time(label):
 def utility_processor():
     return dict(
         get_csh_name=get_csh_name, get_rit_name=get_rit_name, get_rit_image=get_rit_image, log_time=log_time,
-        get_roles=get_roles
+        role_badges=role_badges
     )
@@ -0,0 +1,128 @@
+"""
+Routes reads to replica databases and everything else to the primary
+
+When SQLALCHEMY_REPLICA_URIS is set, GET and HEAD requests run their queries against one of the replicas (picked per
+request) while other requests, CLI commands, and background threads use the primary. Flushes always go to the primary no
+matter where the session is pointed.
+
+Replicas lag a little behind the primary, so after a request writes anything the rest of its reads go to the primary
+and the user's session cookie is marked to stay on the primary for REPLICA_STICKY_SECONDS. That way a freshly signed
+packet shows up as signed on the next page load. Process-wide state that's synced from the DB (the DataVersion stamps
+and the signature matrix) is always read from the primary, since mixing replicas that lag by different amounts could
+move it backwards.
+"""
+
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+# Methods that are safe to serve from a replica
+READ_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+# Key in the user's session cookie holding the time until which their reads stay on the primary
+STICKY_KEY = 'db_primary_until'
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session that sends reads to session.info['replica'] when it's set. Once the session has written anything its reads
+    go to the primary too so they see the write.
+    """
+    def get_bind(self, mapper=None, clause=None):
+        replica = self.info.get('replica')
+        if replica is not None and not self._flushing and not self.info.get('wrote'):
+            return replica
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def record_write(db_session, flush_context):  # pylint: disable=unused-argument
+    db_session.info['wrote'] = True
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """
+    Flask-SQLAlchemy with optional read replicas
+    """
+    def __init__(self, *args, **kwargs):
+        self._replica_engines = None
+        super().__init__(*args, **kwargs)
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 10)
+
+        @app.before_request
+        def route_request_reads():
+            """
+            Points the request's session at a replica if the request only reads and the user hasn't written recently
+            """
+            if request.method in READ_METHODS and session.get(STICKY_KEY, 0) < time.time():
+                self.session.info['replica'] = self.replica_engine()
+
+        @app.after_request
+        def stick_to_primary(response):
+            """
+            Keeps the user's reads on the primary for a while after they write so they see their own changes
+            """
+            if self.session.info.get('wrote') and app.config['SQLALCHEMY_REPLICA_URIS']:
+                session[STICKY_KEY] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+            return response
+
+    def replica_engine(self):
+        """
+        :return: A randomly chosen replica engine, or None if no replicas are configured
+        """
+        if self._replica_engines is None:
+            app = self.get_app()
+            self._replica_engines = [create_engine(uri, pool_pre_ping=True)
+                                     for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+            if self._replica_engines:
+                app.logger.info('SQLAlchemy reads routed to {} replica(s)'.format(len(self._replica_engines)))
+
+        return random.choice(self._replica_engines) if self._replica_engines else None
+
+    @contextmanager
+    def use_replica(self):
+        """
+        Context manager that sends the current session's reads to a replica
+        """
+        previous = self.session.info.get('replica')
+        self.session.info['replica'] = self.replica_engine()
+        try:
+            yield
+        finally:
+            self.session.info['replica'] = previous
+
+    @contextmanager
+    def use_primary(self):
+        """
+        Context manager that sends the current session's reads to the primary
+        """
+        previous = self.session.info.pop('replica', None)
+        try:
+            yield
+        finally:
+            self.session.info['replica'] = previous
+
+
+def replica_reads(func):
+    """
+    Decorator for read only CLI commands that can run against a replica
+    """
+    @wraps(func)
+    def wrapped_function(*args, **kwargs):
+        with get_state(current_app).db.use_replica():
+            return func(*args, **kwargs)
+
+    return wrapped_function
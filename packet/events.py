@@ -0,0 +1,70 @@
+"""
+Reading the signature event log incrementally
+
+SignatureEvent ids are handed out when a transaction inserts its events but only become visible once it commits, so
+under concurrent writers a smaller id can show up after a larger one has already been read. An EventCursor remembers
+the ids it skipped over and checks them again on every poll until they appear or GAP_TIMEOUT passes (the ids of rolled
+back transactions never appear), so no committed event is missed.
+"""
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, or_
+
+from . import db
+from .models import SignatureEvent
+
+# How long a skipped id is waited on before it's assumed to belong to a rolled back transaction
+GAP_TIMEOUT = timedelta(minutes=5)
+
+# How far behind the newest event a new cursor checks for events that haven't been committed yet
+_START_WINDOW = 100
+
+
+class EventCursor:
+    """
+    The position of a reader in the SignatureEvent log
+    """
+    def __init__(self):
+        self.position = 0
+        self.gaps = {}
+
+    def start(self):
+        """
+        Moves the cursor to the end of the log. Call it before reading the state the events will be applied to so the
+        events committed while it's read are polled again.
+        """
+        self.position = db.session.query(func.max(SignatureEvent.id)).scalar() or 0
+        self.gaps = {}
+        first = max(self.position - _START_WINDOW, 0) + 1
+        seen = {event_id for event_id, in db.session.query(SignatureEvent.id).filter(SignatureEvent.id >= first)}
+        self._add_gaps(set(range(first, self.position + 1)) - seen)
+
+    def _add_gaps(self, event_ids):
+        now = datetime.now()
+        for event_id in event_ids:
+            self.gaps.setdefault(event_id, now)
+
+    def poll(self, *columns, limit=None):
+        """
+        :param columns: The SignatureEvent columns to return along with the id
+        :param limit: The max number of events to return. The rest are returned by the following polls.
+        :return: A list of (id, *columns) rows for the events committed since the last poll, in id order
+        """
+        expired = datetime.now() - GAP_TIMEOUT
+        self.gaps = {event_id: missed for event_id, missed in self.gaps.items() if missed > expired}
+
+        criteria = SignatureEvent.id > self.position
+        if self.gaps:
+            criteria = or_(criteria, SignatureEvent.id.in_(self.gaps))
+        events = db.session.query(SignatureEvent.id, *columns).filter(criteria).order_by(SignatureEvent.id) \
+            .limit(limit).all()
+
+        event_ids = [event[0] for event in events]
+        for event_id in event_ids:
+            self.gaps.pop(event_id, None)
+        if event_ids and event_ids[-1] > self.position:
+            self._add_gaps(set(range(self.position + 1, event_ids[-1])) - set(event_ids))
+            self.position = event_ids[-1]
+
+        return events
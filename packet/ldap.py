@@ -2,44 +2,255 @@
 Helper functions for working with the csh_ldap library
 """
 
-from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
+from types import MappingProxyType
 
-from packet import _ldap
+import ldap
+from ldap.filter import escape_filter_chars
+
+from packet import _ldap_pool
+from packet.cache import cached
+from packet.concurrency import run_blocking
+from packet.models import ROLE_ACTIVE_RTP, ROLE_THREE_DA, ROLE_WEBMASTER, ROLE_C_M, ROLE_DRINK_ADMIN
+
+# Eboard groups and their role names in the order _eboard_role_of() checks them
+EBOARD_ROLES = (('eboard-chairman', 'Chairman'), ('eboard-evaluations', 'Evals'), ('eboard-financial', 'Financial'),
+                ('eboard-history', 'History'), ('eboard-imps', 'Imps'), ('eboard-opcomm', 'OpComm'),
+                ('eboard-research', 'R&D'), ('eboard-social', 'Social'), ('eboard-secretary', 'Secretary'))
+
+# The eboard groups that get a vote
+VOTING_EBOARD_GROUPS = tuple(group for group, _ in EBOARD_ROLES if group != 'eboard-secretary')
+
+USERS_OU = 'cn=users,cn=accounts,dc=csh,dc=rit,dc=edu'
+GROUPS_OU = 'cn=groups,cn=accounts,dc=csh,dc=rit,dc=edu'
+
+# The attributes copied into LDAPMember instances
+MEMBER_ATTRIBUTES = ['uid', 'cn', 'roomNumber', 'memberOf']
+
+# Groups that map to UpperSignature.roles bits
+ROLE_GROUPS = (('active_rtp', ROLE_ACTIVE_RTP), ('3da', ROLE_THREE_DA), ('webmaster', ROLE_WEBMASTER),
+               ('constitutional_maintainers', ROLE_C_M), ('drink', ROLE_DRINK_ADMIN))
+
+
+def _group_dn(group):
+    return 'cn={},{}'.format(group, GROUPS_OU)
+
+
+def _group_cn(group_dn):
+    """
+    :return: The group name from a DN of the form cn={group},cn=groups,...
+    """
+    return group_dn.split(',', 1)[0][3:]
+
+
+def _decode(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+def _ldap_search_users(search_filter, attributes):
+    """
+    Runs a single search over the users OU
+    :return: A list of (dn, attributes) tuples
+    """
+    return _ldap_pool.run(lambda con: run_blocking(con.get_con().search_s, USERS_OU, ldap.SCOPE_SUBTREE, search_filter,
+                                                   attributes))
+
+
+class LDAPMember:
+    """
+    A plain copy of a member's MEMBER_ATTRIBUTES. Unlike a CSHMember it doesn't hold on to the LDAP connection it was
+    fetched with, so it's safe to cache and to use from any thread. Like a CSHMember, attributes with a single value
+    are strings and ones with several are lists.
+    """
+    __slots__ = ('dn', 'attributes', '_groups')
+
+    def __init__(self, dn, attributes):
+        """
+        :param attributes: A dict of attribute names to lists of values
+        """
+        self.dn = dn
+        self.attributes = attributes
+        self._groups = None
+
+    @classmethod
+    def from_result(cls, dn, attributes):
+        """
+        :param dn: The DN from a search result
+        :param attributes: The attributes dict from a search result
+        """
+        return cls(_decode(dn), {name: [_decode(value) for value in values] for name, values in attributes.items()})
+
+    def get_dn(self):
+        return self.dn
+
+    @property
+    def groups(self):
+        """
+        :return: A frozenset of the names of the groups the member is in, parsed from memberOf on first use
+        """
+        if self._groups is None:
+            self._groups = frozenset(_group_cn(dn) for dn in self.attributes.get('memberOf', []))
+        return self._groups
+
+    def __getattr__(self, name):
+        values = self.attributes.get(name)
+        if not values:
+            raise AttributeError('Member {} has no {} attribute'.format(self.dn, name))
+        return values[0] if len(values) == 1 else values
 
 
 def _ldap_get_group_members(group):
     """
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
-    return _ldap.get_group(group).get_members()
+    return [LDAPMember.from_result(dn, attrs)
+            for dn, attrs in _ldap_search_users(_members_of_filter([group]), MEMBER_ATTRIBUTES)]
 
 
-def _ldap_is_member_of_group(member, group):
+def _members_of_filter(groups):
     """
-    :param member: A CSHMember instance
+    :return: A filter matching users in any of the given groups
     """
-    for group_dn in member.get('memberOf'):
-        if group == group_dn.split(',')[0][3:]:
-            return True
+    return '(|{})'.format(''.join('(memberOf={})'.format(_group_dn(group)) for group in groups))
 
-    return False
+
+def _ldap_get_group_uids(group):
+    """
+    :return: A list of usernames
+    """
+    return [_decode(attrs['uid'][0]) for _, attrs in _ldap_search_users(_members_of_filter([group]), ['uid'])
+            if 'uid' in attrs]
+
+
+def _ldap_executor():
+    """
+    :return: An executor for running searches in parallel without waiting on the pool. Every search of a batch should
+             go through the same one since each checks out its own connection.
+    """
+    return ThreadPoolExecutor(max_workers=_ldap_pool.size)
+
+
+def _get_group_uids(executor, groups):
+    return dict(zip(groups, executor.map(_ldap_get_group_uids, groups)))
+
+
+def ldap_get_group_uids(*groups):
+    """
+    Fetches the usernames in several groups in parallel, one pooled connection per group
+    :return: A dict of group names to lists of usernames
+    """
+    with _ldap_executor() as executor:
+        return _get_group_uids(executor, groups)
+
+
+class DirectorySnapshot(namedtuple('DirectorySnapshot', ['upper', 'eboard_roles', 'roles'])):
+    """
+    Immutable copy of the parts of LDAP the season commands need
+        upper: A tuple of the usernames of active members who aren't freshmen or on co-op
+        eboard_roles: A read only mapping of usernames to eboard role names
+        roles: A read only mapping of usernames to UpperSignature.roles bitmasks
+    """
+    __slots__ = ()
+
+    def apply_roles(self, sig):
+        """
+        Sets the role fields of an UpperSignature from the snapshot
+        """
+        sig.eboard = self.eboard_roles.get(sig.member)
+        sig.roles = self.roles.get(sig.member, 0)
+
+
+def ldap_prefetch_directory():
+    """
+    Fetches every group the season commands need in parallel
+    :return: A DirectorySnapshot
+    """
+    coop = 'fall_coop' if date.today().month > 6 else 'spring_coop'
+    with _ldap_executor() as executor:
+        eboard_roles = executor.submit(ldap_get_eboard_roster)
+        groups = _get_group_uids(executor, ('active', 'intromembers', coop) + tuple(group for group, _ in ROLE_GROUPS))
+
+    excluded = set(groups['intromembers']) | set(groups[coop])
+    upper = tuple(uid for uid in groups['active'] if uid not in excluded)
+
+    roles = {}
+    for group, bit in ROLE_GROUPS:
+        for uid in groups[group]:
+            roles[uid] = roles.get(uid, 0) | bit
+
+    return DirectorySnapshot(upper, MappingProxyType(eboard_roles.result()), MappingProxyType(roles))
+
+
+def _eboard_role_of(groups):
+    """
+    :param groups: A set of group names
+    :return: The role name of the first eboard group in groups, or None
+    """
+    for group, role in EBOARD_ROLES:
+        if group in groups:
+            return role
+
+    return None
+
+
+def ldap_get_eboard_roster():
+    """
+    Fetches every eboard member's role with a single search
+    :return: A dict of usernames to eboard role names
+    """
+    roster = {}
+    for dn, attrs in _ldap_search_users(_members_of_filter(group for group, _ in EBOARD_ROLES), ['uid', 'memberOf']):
+        member = LDAPMember.from_result(dn, attrs)
+        if 'uid' in member.attributes:
+            roster[member.uid] = _eboard_role_of(member.groups)
+
+    return roster
+
+
+def ldap_get_member_groups(member):
+    """
+    :param member: An LDAPMember instance
+    :return: A frozenset of the names of the groups the member is in, from the memberOf values it was fetched with
+    """
+    return member.groups
+
+
+def _ldap_is_member_of_group(member, group):
+    """
+    :param member: An LDAPMember instance
+    """
+    return group in ldap_get_member_groups(member)
 
 
 # Getters
 
-@lru_cache(maxsize=256)
+@cached('member:entry', maxsize=256)
+def _ldap_get_member_result(username):
+    """
+    :return: A [dn, attributes] list for the member with the given username
+    """
+    results = _ldap_search_users('(uid={})'.format(escape_filter_chars(username)), MEMBER_ATTRIBUTES)
+    if not results:
+        raise KeyError('No member with the username ' + username)
+
+    member = LDAPMember.from_result(*results[0])
+    return [member.dn, member.attributes]
+
+
 def ldap_get_member(username):
     """
-    :return: A CSHMember instance
+    :return: An LDAPMember instance
+    :raises KeyError: If there's no member with the given username
     """
-    return _ldap.get_member(username, uid=True)
+    return LDAPMember(*_ldap_get_member_result(username))
 
 
 def ldap_get_active_members():
     """
     Gets all current, dues-paying members
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return _ldap_get_group_members('active')
 
@@ -47,29 +258,24 @@ def ldap_get_active_members():
 def ldap_get_intro_members():
     """
     Gets all freshmen members
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return _ldap_get_group_members('intromembers')
 
 
 def ldap_get_eboard():
     """
-    Gets all voting members of eboard
-    :return: A list of CSHMember instances
+    Gets all voting members of eboard with a single search
+    :return: A list of LDAPMember instances
     """
-    members = _ldap_get_group_members('eboard-chairman') + _ldap_get_group_members('eboard-evaluations'
-        ) + _ldap_get_group_members('eboard-financial') + _ldap_get_group_members('eboard-history'
-        ) + _ldap_get_group_members('eboard-imps') + _ldap_get_group_members('eboard-opcomm'
-        ) + _ldap_get_group_members('eboard-research') + _ldap_get_group_members('eboard-social'
-        )
-
-    return members
+    return [LDAPMember.from_result(dn, attrs)
+            for dn, attrs in _ldap_search_users(_members_of_filter(VOTING_EBOARD_GROUPS), MEMBER_ATTRIBUTES)]
 
 
 def ldap_get_live_onfloor():
     """
     All upperclassmen who live on floor and are not eboard
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     members = []
     onfloor = _ldap_get_group_members('onfloor')
@@ -83,7 +289,7 @@ def ldap_get_live_onfloor():
 def ldap_get_active_rtps():
     """
     All active RTPs
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return [member.uid for member in _ldap_get_group_members('active_rtp')]
 
@@ -91,7 +297,7 @@ def ldap_get_active_rtps():
 def ldap_get_3das():
     """
     All 3das
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return [member.uid for member in _ldap_get_group_members('3da')]
 
@@ -99,7 +305,7 @@ def ldap_get_3das():
 def ldap_get_webmasters():
     """
     All webmasters
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return [member.uid for member in _ldap_get_group_members('webmaster')]
 
@@ -107,7 +313,7 @@ def ldap_get_webmasters():
 def ldap_get_constitutional_maintainers():
     """
     All constitutional maintainers
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return [member.uid for member in _ldap_get_group_members('constitutional_maintainers')]
 
@@ -115,59 +321,33 @@ def ldap_get_constitutional_maintainers():
 def ldap_get_drink_admins():
     """
     All drink admins
-    :return: A list of CSHMember instances
+    :return: A list of LDAPMember instances
     """
     return [member.uid for member in _ldap_get_group_members('drink')]
 
 
-def ldap_get_eboard_role(member):
-    """
-    :param member: A CSHMember instance
-    :return: A String or None
-    """
-
-    return_val = None
-
-    if _ldap_is_member_of_group(member, 'eboard-chairman'):
-        return_val = 'Chairman'
-    elif _ldap_is_member_of_group(member, 'eboard-evaluations'):
-        return_val = 'Evals'
-    elif _ldap_is_member_of_group(member, 'eboard-financial'):
-        return_val = 'Financial'
-    elif _ldap_is_member_of_group(member, 'eboard-history'):
-        return_val = 'History'
-    elif _ldap_is_member_of_group(member, 'eboard-imps'):
-        return_val = 'Imps'
-    elif _ldap_is_member_of_group(member, 'eboard-opcomm'):
-        return_val = 'OpComm'
-    elif _ldap_is_member_of_group(member, 'eboard-research'):
-        return_val = 'R&D'
-    elif _ldap_is_member_of_group(member, 'eboard-social'):
-        return_val = 'Social'
-    elif _ldap_is_member_of_group(member, 'eboard-secretary'):
-        return_val = 'Secretary'
-
-    return return_val
-
 # Status checkers
 
 def ldap_is_eboard(member):
     """
-    :param member: A CSHMember instance
+    :param member: An LDAPMember instance
     """
     return _ldap_is_member_of_group(member, 'eboard')
 
 
 def ldap_is_intromember(member):
     """
-    :param member: A CSHMember instance
+    Always checked live rather than through the cached groups since it gates access to the upperclassmen site
+    :param member: An LDAPMember instance
     """
-    return _ldap_is_member_of_group(member, 'intromembers')
+    results = _ldap_pool.run(lambda con: run_blocking(con.get_con().search_s, member.get_dn(), ldap.SCOPE_BASE,
+                                                      '(memberOf={})'.format(_group_dn('intromembers')), ['1.1']))
+    return bool(results)
 
 
 def ldap_is_on_coop(member):
     """
-    :param member: A CSHMember instance
+    :param member: An LDAPMember instance
     """
     if date.today().month > 6:
         return _ldap_is_member_of_group(member, 'fall_coop')
@@ -177,7 +357,7 @@ def ldap_is_on_coop(member):
 
 def ldap_get_roomnumber(member):
     """
-    :param member: A CSHMember instance
+    :param member: An LDAPMember instance
     """
     try:
         return member.roomNumber
@@ -0,0 +1,182 @@
+"""
+A bounded, thread-safe pool of CSH LDAP connections
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+import ldap
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no LDAP connection could be checked out before the timeout
+    """
+
+
+class LDAPPool:
+    """
+    Hands out CSHLDAP connections to one thread at a time. Connections are created lazily up to size, checked for
+    liveness when they've sat idle, and replaced (and unbound) when they fail.
+
+    Nothing fetched through a connection should hold on to it after it's returned. CSHMember instances do, since their
+    attribute lookups go through the connection they were fetched with, so packet.ldap copies the attributes it needs
+    into LDAPMember instances instead.
+    """
+    def __init__(self, connect, size=4, timeout=10, check_after=60):
+        """
+        :param connect: A function that returns a new CSHLDAP instance
+        :param size: The max number of open connections
+        :param timeout: Seconds to wait for a free connection before raising PoolTimeout
+        :param check_after: Seconds a connection can sit idle before it's checked for liveness on checkout
+        """
+        self._connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.check_after = check_after
+
+        self._cond = threading.Condition()
+        self._idle = []
+        self._open = 0
+
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._failures = 0
+        self._in_use = 0
+        self._peak_in_use = 0
+
+    def warm(self):
+        """
+        Opens the first connection so misconfiguration shows up at startup
+        """
+        with self.connection():
+            pass
+
+    def _checkout(self):
+        start = time.time()
+        with self._cond:
+            while not self._idle and self._open >= self.size:
+                remaining = self.timeout - (time.time() - start)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout('No LDAP connection available after {} seconds'.format(self.timeout))
+                self._cond.wait(remaining)
+
+            waited = time.time() - start
+            self._checkouts += 1
+            if waited > 0.001:
+                self._waits += 1
+                self._wait_time += waited
+
+            self._in_use += 1
+            self._peak_in_use = max(self._peak_in_use, self._in_use)
+
+            if self._idle:
+                con, last_used = self._idle.pop()
+            else:
+                con, last_used = None, None
+                self._open += 1
+
+        try:
+            if con is not None and time.time() - last_used > self.check_after and not self._is_alive(con):
+                with self._cond:
+                    self._failures += 1
+                self._close(con)
+                con = None
+            if con is None:
+                con = self._connect()
+        except Exception:
+            self._release(None)
+            raise
+
+        return con
+
+    @staticmethod
+    def _is_alive(con):
+        try:
+            con.get_con().whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    @staticmethod
+    def _close(con):
+        """
+        Unbinds a discarded connection, ignoring errors from one that's already dead
+        """
+        try:
+            con.get_con().unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    def _release(self, con):
+        """
+        Returns a connection to the pool. Passing None discards the connection's slot instead.
+        """
+        with self._cond:
+            self._in_use -= 1
+            if con is None:
+                self._open -= 1
+                self._failures += 1
+            else:
+                self._idle.append((con, time.time()))
+            self._cond.notify()
+
+    def _expire_idle(self):
+        """
+        Forces a liveness check on every idle connection the next time it's checked out
+        """
+        with self._cond:
+            self._idle = [(con, 0) for con, _ in self._idle]
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks out a connection. Connections that raise LDAP server errors are discarded.
+        """
+        con = self._checkout()
+        try:
+            yield con
+        except (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR):
+            # If the server dropped one connection the others are probably dead too
+            self._close(con)
+            self._release(None)
+            self._expire_idle()
+            raise
+        except BaseException:
+            self._release(con)
+            raise
+        else:
+            self._release(con)
+
+    def run(self, func):
+        """
+        Calls func with a checked out connection, retrying once on a fresh connection if the server dropped it
+        """
+        try:
+            with self.connection() as con:
+                return func(con)
+        except (ldap.SERVER_DOWN, ldap.CONNECT_ERROR):
+            with self.connection() as con:
+                return func(con)
+
+    def stats(self):
+        """
+        :return: A dict of utilization metrics
+        """
+        with self._cond:
+            return {
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'peak_in_use': self._peak_in_use,
+                'checkouts': self._checkouts,
+                'waits': self._waits,
+                'avg_wait': self._wait_time / self._waits if self._waits else 0,
+                'timeouts': self._timeouts,
+                'failures': self._failures,
+            }
@@ -0,0 +1,65 @@
+"""
+Files the workers on a host share on local disk
+
+The shared cache, the slow request buffer, and profiles hold member data and SQL, so they default to the app's instance
+folder and are only ever used when no other local user can read or replace them. A file or directory that's owned by
+another user, accessible to others, or a symlink is refused instead.
+"""
+
+import os
+import stat
+
+from . import app
+
+
+def instance_path(configured, name):
+    """
+    :return: The configured path, or the given name in the app's instance folder
+    """
+    return configured or os.path.join(app.instance_path, name)
+
+
+def _is_private(status):
+    return status.st_uid == os.getuid() and not status.st_mode & 0o077
+
+
+def private_dir(path):
+    """
+    Creates the given directory if needed, accessible only by this process' user
+    :return: Whether the directory is safe to use
+    """
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        status = os.lstat(path)
+    except OSError as error:
+        app.logger.error('Can\'t create the directory {}: {}'.format(path, error))
+        return False
+
+    if not stat.S_ISDIR(status.st_mode) or not _is_private(status):
+        app.logger.error('Not using {} since it isn\'t a directory only this user can access'.format(path))
+        return False
+    return True
+
+
+def private_file(path):
+    """
+    Creates the given file (and its directory) if needed, readable and writable only by this process' user
+    :return: Whether the file is safe to use
+    """
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+    except OSError as error:
+        app.logger.error('Can\'t open the file {}: {}'.format(path, error))
+        return False
+
+    try:
+        status = os.fstat(fd)
+    finally:
+        os.close(fd)
+
+    if not _is_private(status):
+        app.logger.error('Not using the file {} since it\'s owned by another user or accessible to others'
+                         .format(path))
+        return False
+    return True
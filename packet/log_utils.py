@@ -5,10 +5,13 @@ General utilities for logging metadata
 from functools import wraps
 from datetime import datetime
 
-from packet import app
-from packet.context_processors import get_rit_name
-from packet.ldap import ldap_get_member
-from packet.utils import is_freshman_on_floor
+from flask import after_this_request, has_request_context
+
+from packet import app, _ldap_pool
+from packet.cache import cache_stats
+from packet.compression import compression_stats
+from packet.request_cache import request_cache_stats
+from packet.slow_requests import start_capture, stop_capture, build_record, slow_requests
 
 
 def log_time(func):
@@ -29,17 +32,54 @@ def log_time(func):
     return wrapped_function
 
 
-def _format_cache(func):
+def log_slow(func):
     """
-    :return: The output of func.cache_info() as a compactly formatted string
+    Decorator for recording the SQL and query plans of calls that take longer than SLOW_REQUEST_THRESHOLD seconds
     """
-    info = func.cache_info()
-    return '{}[hits={}, misses={}, size={}/{}]'.format(func.__name__, info.hits, info.misses, info.currsize,
-                                                       info.maxsize)
+    @wraps(func)
+    def wrapped_function(*args, **kwargs):
+        if app.config['SLOW_REQUEST_THRESHOLD'] <= 0:
+            return func(*args, **kwargs)
 
+        start = datetime.now()
+        start_capture()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            queries = stop_capture()
 
-# Tuple of lru_cache functions to log stats from
-_caches = (get_rit_name, ldap_get_member, is_freshman_on_floor)
+        seconds = (datetime.now() - start).total_seconds()
+        if seconds >= app.config['SLOW_REQUEST_THRESHOLD']:
+            # Positional arguments are keyed by their index
+            arguments = dict(kwargs)
+            arguments.update((str(index), value) for index, value in enumerate(args))
+            arguments.pop('info', None)
+            app.logger.warning('{}.{}() was slow ({} seconds, {} statements)'.format(func.__module__, func.__name__,
+                                                                                   seconds, len(queries)))
+
+            def record():
+                slow_requests.append(build_record('{}.{}'.format(func.__module__, func.__name__), arguments, seconds,
+                                                  queries))
+
+            if has_request_context():
+                # EXPLAINing the statements is more DB work, so it waits until the client has its response
+                @after_this_request
+                def record_on_close(response):
+                    response.call_on_close(record)
+                    return response
+            else:
+                record()
+
+        return result
+
+    return wrapped_function
+
+
+def _format_cache(namespace, info):
+    """
+    :return: The given CacheInfo as a compactly formatted string
+    """
+    return '{}[hits={}, misses={}, size={}/{}]'.format(namespace, info.hits, info.misses, info.currsize, info.maxsize)
 
 
 def log_cache(func):
@@ -51,7 +91,12 @@ def log_cache(func):
     def wrapped_function(*args, **kwargs):
         result = func(*args, **kwargs)
 
-        app.logger.info('Cache stats: ' + ', '.join(map(_format_cache, _caches)))
+        app.logger.info('Cache stats: ' + ', '.join(_format_cache(*stats) for stats in sorted(cache_stats().items())))
+        app.logger.info('LDAP pool stats: ' + ', '.join('{}={}'.format(*stat) for stat in _ldap_pool.stats().items()))
+        app.logger.info('Compression stats: ' + ', '.join('{}={}'.format(*stat) for stat in
+                                                          compression_stats().items()))
+        app.logger.info('Request cache stats: ' + ', '.join('{}[hits={}, misses={}]'.format(kind, *stats)
+                                                            for kind, stats in request_cache_stats().items()))
 
         return result
 
@@ -2,17 +2,31 @@
 Defines the application's database models
 """
 
+import json
+import zlib
+from collections import namedtuple
 from datetime import datetime
 from itertools import chain
 
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Boolean, Date, Index, JSON, LargeBinary
 from sqlalchemy.orm import relationship
 
 from . import db
+from .request_cache import request_cached
 
 # The required number of honorary member, advisor, and alumni signatures
 REQUIRED_MISC_SIGNATURES = 10
 
+# Bits of UpperSignature.roles
+ROLE_ACTIVE_RTP = 1 << 0
+ROLE_THREE_DA = 1 << 1
+ROLE_WEBMASTER = 1 << 2
+ROLE_C_M = 1 << 3
+ROLE_DRINK_ADMIN = 1 << 4
+
+# How PacketArchive stores timestamps
+_ARCHIVE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
 
 class SigCounts:
     """
@@ -45,9 +59,9 @@ class Freshman(db.Model):
     @classmethod
     def by_username(cls, username: str):
         """
-        Helper method to retrieve a freshman by their RIT username
+        Helper method to retrieve a freshman by their RIT username. The result is reused for the rest of the request.
         """
-        return cls.query.filter_by(rit_username=username).first()
+        return request_cached('freshman', username, lambda: cls.query.filter_by(rit_username=username).first())
 
 
 class Packet(db.Model):
@@ -55,17 +69,20 @@ class Packet(db.Model):
     id = Column(Integer, primary_key=True, autoincrement=True)
     freshman_username = Column(ForeignKey('freshman.rit_username'))
     start = Column(DateTime, nullable=False)
-    end = Column(DateTime, nullable=False)
+    # Indexed so finding the open packets doesn't scan every past season
+    end = Column(DateTime, nullable=False, index=True)
 
     freshman = relationship('Freshman', back_populates='packets')
 
-    # The `lazy='subquery'` kwarg enables eager loading for signatures which makes signature calculations much faster
+    # The `lazy='selectin'` kwarg enables eager loading for signatures which makes signature calculations much faster.
+    # Unlike `lazy='subquery'` it filters on a literal list of packet ids, which lets Postgres skip the signature table
+    # partitions of other seasons.
     # See the docs here for details: https://docs.sqlalchemy.org/en/latest/orm/loading_relationships.html
-    upper_signatures = relationship('UpperSignature', lazy='subquery',
+    upper_signatures = relationship('UpperSignature', lazy='selectin',
                                     order_by='UpperSignature.signed.desc(), UpperSignature.updated')
-    fresh_signatures = relationship('FreshSignature', lazy='subquery',
+    fresh_signatures = relationship('FreshSignature', lazy='selectin',
                                     order_by='FreshSignature.signed.desc(), FreshSignature.updated')
-    misc_signatures = relationship('MiscSignature', lazy='subquery', order_by='MiscSignature.updated')
+    misc_signatures = relationship('MiscSignature', lazy='selectin', order_by='MiscSignature.updated')
 
     def is_open(self):
         return self.start < datetime.now() < self.end
@@ -123,9 +140,9 @@ class Packet(db.Model):
     @classmethod
     def by_id(cls, packet_id):
         """
-        Helper method for fetching 1 packet by its id
+        Helper method for fetching 1 packet by its id. The result is reused for the rest of the request.
         """
-        return cls.query.filter_by(id=packet_id).first()
+        return request_cached('packet', str(packet_id), lambda: cls.query.filter_by(id=packet_id).first())
 
 class UpperSignature(db.Model):
     __tablename__ = 'signature_upper'
@@ -133,11 +150,7 @@ class UpperSignature(db.Model):
     member = Column(String(36), primary_key=True)
     signed = Column(Boolean, default=False, nullable=False)
     eboard = Column(String(12), nullable=True)
-    active_rtp = Column(Boolean, default=False, nullable=False)
-    three_da = Column(Boolean, default=False, nullable=False)
-    webmaster = Column(Boolean, default=False, nullable=False)
-    c_m = Column(Boolean, default=False, nullable=False)
-    drink_admin = Column(Boolean, default=False, nullable=False)
+    roles = Column(Integer, default=0, nullable=False)
     updated = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
 
     packet = relationship('Packet', back_populates='upper_signatures')
@@ -163,8 +176,196 @@ class MiscSignature(db.Model):
     packet = relationship('Packet', back_populates='misc_signatures')
 
 
+class SignatureEvent(db.Model):
+    """
+    Append-only log of every change made to the signature tables. See packet.projections for replaying it.
+        sig_type: One of 'upper', 'fresh', or 'misc'
+        action: One of 'require' (a signature row was created), 'drop' (a signature row was deleted), 'sign', or
+                'unsign'. Misc signatures only have sign and unsign events since their rows are the signatures.
+    """
+    __tablename__ = 'signature_event'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    packet_id = Column(Integer, ForeignKey('packet.id'), nullable=False, index=True)
+    sig_type = Column(String(5), nullable=False)
+    username = Column(String(36), nullable=False)
+    action = Column(String(7), nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+
+    packet = relationship('Packet')
+
+    @classmethod
+    def record(cls, packet, sig_type, username, action):
+        """
+        Appends an event for a change to the given packet's signatures. The caller is responsible for committing.
+        """
+        db.session.add(cls(packet=packet, sig_type=sig_type, username=username, action=action))
+
+
+# Stand-ins for the signature models built from a PacketSnapshot
+FrozenUpperSignature = namedtuple('FrozenUpperSignature', ['member', 'signed', 'eboard', 'roles'])
+FrozenFreshSignature = namedtuple('FrozenFreshSignature', ['freshman_username', 'signed'])
+FrozenMiscSignature = namedtuple('FrozenMiscSignature', ['member'])
+
+
+class PacketSnapshot(db.Model):
+    """
+    The final results of a closed packet, written once by the close-packets command so reads of closed packets don't
+    need the signature tables
+        signers: A dict with 'upper' ([member, signed, eboard, roles] lists), 'fresh' ([username, signed] lists), and
+                 'misc' (usernames) keys, each in the same order as the matching Packet relationship
+    """
+    __tablename__ = 'packet_snapshot'
+    packet_id = Column(Integer, ForeignKey('packet.id'), primary_key=True)
+    upper_received = Column(Integer, nullable=False)
+    upper_required = Column(Integer, nullable=False)
+    fresh_received = Column(Integer, nullable=False)
+    fresh_required = Column(Integer, nullable=False)
+    misc_received = Column(Integer, nullable=False)
+    signers = Column(JSON, nullable=False)
+    created = Column(DateTime, default=datetime.now, nullable=False)
+
+    def signatures_required(self):
+        """
+        Same contract as Packet.signatures_required()
+        """
+        return SigCounts(self.upper_required, self.fresh_required, REQUIRED_MISC_SIGNATURES)
+
+    def signatures_received(self):
+        """
+        Same contract as Packet.signatures_received()
+        """
+        return SigCounts(self.upper_received, self.fresh_received, self.misc_received)
+
+    def upper_signatures(self):
+        return [FrozenUpperSignature(*sig) for sig in self.signers['upper']]
+
+    def fresh_signatures(self):
+        return [FrozenFreshSignature(*sig) for sig in self.signers['fresh']]
+
+    def misc_signatures(self):
+        return [FrozenMiscSignature(member) for member in self.signers['misc']]
+
+    def did_sign(self, username, is_csh):
+        """
+        Same contract as Packet.did_sign()
+        """
+        if is_csh:
+            return username in self.signers['misc'] or \
+                any(sig[0] == username and sig[1] for sig in self.signers['upper'])
+        return any(sig[0] == username and sig[1] for sig in self.signers['fresh'])
+
+
+class PacketArchive(db.Model):
+    """
+    The signature rows of a packet from an archived season as zlib compressed JSON. See the archive-season command.
+    """
+    __tablename__ = 'packet_archive'
+    packet_id = Column(Integer, ForeignKey('packet.id'), primary_key=True)
+    signatures = Column(LargeBinary, nullable=False)
+    archived = Column(DateTime, default=datetime.now, nullable=False)
+
+    @classmethod
+    def pack(cls, packet_id, upper, fresh, misc):
+        """
+        :param upper: The packet's UpperSignatures
+        :param fresh: The packet's FreshSignatures
+        :param misc: The packet's MiscSignatures
+        :return: A new PacketArchive holding the given rows
+        """
+        def timestamp(sig):
+            return sig.updated.strftime(_ARCHIVE_TIME_FORMAT)
+
+        rows = {
+            'upper': [[sig.member, sig.signed, sig.eboard, sig.roles, timestamp(sig)] for sig in upper],
+            'fresh': [[sig.freshman_username, sig.signed, timestamp(sig)] for sig in fresh],
+            'misc': [[sig.member, timestamp(sig)] for sig in misc],
+        }
+        return cls(packet_id=packet_id, signatures=zlib.compress(json.dumps(rows, separators=(',', ':')).encode(), 9))
+
+    def unpack(self):
+        """
+        :return: A tuple of lists of the archived UpperSignatures, FreshSignatures, and MiscSignatures. The instances
+                 aren't added to the session.
+        """
+        rows = json.loads(zlib.decompress(self.signatures).decode())
+        def parse(updated):
+            return datetime.strptime(updated, _ARCHIVE_TIME_FORMAT)
+
+        upper = [UpperSignature(packet_id=self.packet_id, member=member, signed=signed, eboard=eboard, roles=roles,
+                                updated=parse(updated)) for member, signed, eboard, roles, updated in rows['upper']]
+        fresh = [FreshSignature(packet_id=self.packet_id, freshman_username=username, signed=signed,
+                                updated=parse(updated)) for username, signed, updated in rows['fresh']]
+        misc = [MiscSignature(packet_id=self.packet_id, member=member, updated=parse(updated))
+                for member, updated in rows['misc']]
+        return upper, fresh, misc
+
+
 class NotificationSubscription(db.Model):
     __tablename__ = 'notification_subscriptions'
     member = Column(String(36), nullable=True)
     freshman_username = Column(ForeignKey('freshman.rit_username'), nullable=True)
     token = Column(String(256), primary_key=True, nullable=False)
+
+
+class SeasonStats(db.Model):
+    """
+    Per-season totals for the analytics views. A season is identified by the start date shared by its packets.
+    """
+    __tablename__ = 'stats_season'
+    season = Column(Date, primary_key=True)
+    packets = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    upper_signatures = Column(Integer, default=0, nullable=False)
+    fresh_signatures = Column(Integer, default=0, nullable=False)
+    misc_signatures = Column(Integer, default=0, nullable=False)
+
+    def completion_rate(self):
+        return self.completed / self.packets if self.packets else 0
+
+
+class DailyStats(db.Model):
+    """
+    Number of signatures collected per day of a season
+    """
+    __tablename__ = 'stats_daily'
+    season = Column(Date, primary_key=True)
+    day = Column(Date, primary_key=True)
+    signatures = Column(Integer, default=0, nullable=False)
+
+
+class MemberSeasonStats(db.Model):
+    """
+    Number of packets signed by each member or freshman per season
+    """
+    __tablename__ = 'stats_member'
+    season = Column(Date, primary_key=True)
+    member = Column(String(36), primary_key=True)
+    freshman = Column(Boolean, default=False, nullable=False)
+    signatures = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (Index('ix_stats_member_season_signatures', 'season', 'signatures'),)
+
+
+class DataVersion(db.Model):
+    """
+    Version stamps bumped by the CLI commands that change shared state so each worker knows which caches are stale
+    """
+    __tablename__ = 'data_version'
+    namespace = Column(String(32), primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+
+    @classmethod
+    def bump(cls, *namespaces):
+        """
+        Increments the version of each namespace. The caller is responsible for committing.
+        """
+        for namespace in namespaces:
+            if not cls.query.filter_by(namespace=namespace).update({cls.version: cls.version + 1}):
+                db.session.add(cls(namespace=namespace, version=1))
+
+    @classmethod
+    def current(cls):
+        """
+        :return: A dict of every namespace to its current version
+        """
+        return dict(db.session.query(cls.namespace, cls.version))
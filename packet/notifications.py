@@ -1,47 +1,215 @@
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import onesignal
+from sqlalchemy import event
+from sqlalchemy.exc import SQLAlchemyError
 
-from packet import app, intro_onesignal_client, csh_onesignal_client
-from packet.models import NotificationSubscription
+from packet import app, db, intro_onesignal_client, csh_onesignal_client
+from packet.models import NotificationSubscription, Freshman
 
-post_body = {
-    'contents': {'en': 'Default message'},
-    'headings': {'en': 'Default Title'},
-    'chrome_web_icon': app.config['PROTOCOL'] + app.config['SERVER_NAME'] + '/static/android-chrome-512x512.png',
-    'chrome_web_badge': app.config['PROTOCOL'] + app.config['SERVER_NAME'] + '/static/android-chrome-512x512.png',
-    'url': app.config['PROTOCOL'] + app.config['SERVER_NAME']
-}
 
+def new_post_body():
+    """
+    :return: A fresh notification body with the default fields filled in
+    """
+    return {
+        'contents': {'en': 'Default message'},
+        'headings': {'en': 'Default Title'},
+        'chrome_web_icon': app.config['PROTOCOL'] + app.config['SERVER_NAME'] + '/static/android-chrome-512x512.png',
+        'chrome_web_badge': app.config['PROTOCOL'] + app.config['SERVER_NAME'] + '/static/android-chrome-512x512.png',
+        'url': app.config['PROTOCOL'] + app.config['SERVER_NAME']
+    }
 
-def send_notification(notification_body, subscriptions, client):
-    tokens = list(map(lambda subscription: subscription.token, subscriptions))
-    if tokens:
-        notification = onesignal.Notification(post_body=notification_body)
-        notification.post_body['include_player_ids'] = tokens
-        onesignal_response = client.send_notification(notification)
-        if onesignal_response.status_code == 200:
-            app.logger.info('The notification ({}) sent out successfully'.format(notification.post_body))
-        else:
-            app.logger.warn('The notification ({}) was unsuccessful'.format(notification.post_body))
 
+def _stream_tokens(subscriptions, chunk_size):
+    """
+    Reads the tokens matched by a NotificationSubscription query from the DB in chunks
+    """
+    chunk = []
+    for token, in subscriptions.with_entities(NotificationSubscription.token).yield_per(chunk_size):
+        chunk.append(token)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
 
-def packet_signed_notification(packet, signer):
-    subscriptions = NotificationSubscription.query.filter_by(freshman_username=packet.freshman_username)
-    if subscriptions:
-        notification_body = post_body
-        notification_body['contents']['en'] = signer + " signed your packet! Congrats or I'm Sorry"
-        notification_body['headings']['en'] = 'New Packet Signature!'
-        notification_body['chrome_web_icon'] = 'https://profiles.csh.rit.edu/image/' + signer
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(notification_body, tokens, client):
+    """
+    :return: The tokens OneSignal reported as invalid
+    """
+    notification = onesignal.Notification(post_body=dict(notification_body, include_player_ids=tokens))
+    onesignal_response = client.send_notification(notification)
+
+    if onesignal_response.status_code != 200:
+        app.logger.warn('The notification ({}) was unsuccessful for {} devices'.format(
+            notification_body['headings']['en'], len(tokens)))
+        return []
+
+    app.logger.info('The notification ({}) sent out successfully to {} devices'.format(
+        notification_body['headings']['en'], len(tokens)))
+
+    errors = onesignal_response.json().get('errors')
+    return errors.get('invalid_player_ids', []) if isinstance(errors, dict) else []
+
+
+def send_notification(notification_body, subscriptions, client):
+    """
+    Sends a notification to every token matched by the given NotificationSubscription query. Tokens are streamed from
+    the DB in chunks sized to OneSignal's per request limit and the chunks are sent concurrently by a bounded pool.
+    Tokens that OneSignal reports as invalid are deleted in a separate transaction after the caller's transaction ends.
+    Nothing in the caller's session is committed.
+    """
+    chunk_size = app.config['ONESIGNAL_CHUNK_SIZE']
+    max_workers = app.config['ONESIGNAL_FANOUT_WORKERS']
+
+    invalid_tokens = []
+    in_flight = threading.BoundedSemaphore(max_workers)
+
+    def send(tokens):
+        try:
+            return _send_chunk(notification_body, tokens, client)
+        finally:
+            in_flight.release()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for tokens in _stream_tokens(subscriptions, chunk_size):
+            # Wait for a free sender before reading the next chunk so only a few chunks are in memory at once
+            in_flight.acquire()
+            futures.append(executor.submit(send, tokens))
+
+        for future in futures:
+            try:
+                invalid_tokens.extend(future.result())
+            except Exception:  # pylint: disable=broad-except
+                app.logger.exception('Failed to send a chunk of the notification ({})'.format(
+                    notification_body['headings']['en']))
+
+    if invalid_tokens:
+        _prune_tokens(invalid_tokens)
+
+
+def _prune_tokens(tokens):
+    """
+    Queues the given notification tokens to be deleted once the current session's transaction ends. They're deleted
+    in a transaction of their own so the caller's unit of work (ex. a season of packets being created) is never
+    committed by a notification, and waiting for it to end keeps the delete from blocking on its locks.
+    """
+    db.session.info.setdefault('invalid_tokens', []).extend(tokens)
+
+
+@event.listens_for(db.session, 'after_transaction_end')
+def _prune_queued_tokens(session, transaction):
+    if transaction.parent is not None or not session.info.get('invalid_tokens'):
+        return
+
+    tokens = session.info.pop('invalid_tokens')
+    # Pruning is best effort since OneSignal will report the same tokens again on the next notification
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(NotificationSubscription.__table__.delete()
+                               .where(NotificationSubscription.token.in_(tokens)))
+    except SQLAlchemyError:
+        app.logger.exception('Failed to prune {} invalid notification tokens'.format(len(tokens)))
+    else:
+        app.logger.info('Pruned {} invalid notification tokens'.format(len(tokens)))
+
+
+def _describe_signers(signers):
+    """
+    :return: A readable list of signers, ex. 'alice, bob and 3 others'
+    """
+    if len(signers) == 1:
+        return signers[0]
+    elif len(signers) <= 3:
+        return ', '.join(signers[:-1]) + ' and ' + signers[-1]
+    else:
+        return '{}, {} and {} others'.format(signers[0], signers[1], len(signers) - 2)
+
+
+def _send_signed_notification(freshman_username, signers):
+    subscriptions = NotificationSubscription.query.filter_by(freshman_username=freshman_username)
+    if subscriptions.first() is not None:
+        notification_body = new_post_body()
+        if len(signers) == 1:
+            notification_body['contents']['en'] = signers[0] + " signed your packet! Congrats or I'm Sorry"
+            notification_body['headings']['en'] = 'New Packet Signature!'
+        else:
+            notification_body['contents']['en'] = _describe_signers(signers) + ' signed your packet!'
+            notification_body['headings']['en'] = '{} New Packet Signatures!'.format(len(signers))
+        notification_body['chrome_web_icon'] = 'https://profiles.csh.rit.edu/image/' + signers[0]
         notification_body['url'] = app.config['PROTOCOL'] + app.config['PACKET_INTRO']
 
         send_notification(notification_body, subscriptions, intro_onesignal_client)
 
 
+class SignatureCoalescer:
+    """
+    Buffers signatures per freshman so a burst of signings turns into one push. The first signature for a freshman
+    starts a timer and every signature that comes in before it fires is merged into the same notification.
+    """
+    def __init__(self, window):
+        """
+        :param window: Seconds to wait for more signatures before sending. 0 sends each signature immediately.
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def add(self, freshman_username, signer):
+        if self.window <= 0:
+            _send_signed_notification(freshman_username, [signer])
+            return
+
+        with self._lock:
+            if freshman_username in self._pending:
+                self._pending[freshman_username].append(signer)
+                return
+
+            self._pending[freshman_username] = [signer]
+
+        timer = threading.Timer(self.window, self.flush, [freshman_username])
+        timer.daemon = True
+        timer.start()
+
+    def flush(self, freshman_username):
+        with self._lock:
+            signers = self._pending.pop(freshman_username, None)
+
+        if signers:
+            with app.app_context():
+                try:
+                    _send_signed_notification(freshman_username, signers)
+                except Exception:  # pylint: disable=broad-except
+                    app.logger.exception('Failed to send the signed notification for ' + freshman_username)
+
+    def flush_all(self):
+        for freshman_username in list(self._pending):
+            self.flush(freshman_username)
+
+
+_signed_coalescer = SignatureCoalescer(app.config['NOTIFICATION_COALESCE_WINDOW'])
+
+# Don't drop buffered signatures when a worker shuts down
+atexit.register(_signed_coalescer.flush_all)
+
+
+def packet_signed_notification(packet, signer):
+    _signed_coalescer.add(packet.freshman_username, signer)
+
+
 def packet_100_percent_notification(packet):
     member_subscriptions = NotificationSubscription.query.filter(NotificationSubscription.member.isnot(None))
     intro_subscriptions = NotificationSubscription.query.filter(NotificationSubscription.freshman_username.isnot(None))
-    if member_subscriptions or intro_subscriptions:
-        notification_body = post_body
-        notification_body['contents']['en'] = packet.freshman.name + ' got 💯 on packet!'
+    if member_subscriptions.first() is not None or intro_subscriptions.first() is not None:
+        notification_body = new_post_body()
+        freshman = Freshman.by_username(packet.freshman_username)
+        notification_body['contents']['en'] = freshman.name + ' got 💯 on packet!'
         notification_body['headings']['en'] = 'New 100% on Packet!'
         # TODO: Issue #156
         notification_body['chrome_web_icon'] = 'https://profiles.csh.rit.edu/image/' + packet.freshman_username
@@ -52,8 +220,8 @@ def packet_100_percent_notification(packet):
 
 def packet_starting_notification(packet):
     subscriptions = NotificationSubscription.query.filter_by(freshman_username=packet.freshman_username)
-    if subscriptions:
-        notification_body = post_body
+    if subscriptions.first() is not None:
+        notification_body = new_post_body()
         notification_body['contents']['en'] = 'Log into your packet, and get started meeting people!'
         notification_body['headings']['en'] = 'Your packet has begun!'
         notification_body['url'] = app.config['PROTOCOL'] + app.config['PACKET_INTRO']
@@ -64,8 +232,8 @@ def packet_starting_notification(packet):
 
 def packets_starting_notification(start_date):
     member_subscriptions = NotificationSubscription.query.filter(NotificationSubscription.member.isnot(None))
-    if member_subscriptions:
-        notification_body = post_body
+    if member_subscriptions.first() is not None:
+        notification_body = new_post_body()
         notification_body['contents']['en'] = 'New packets have started, visit packet to see them!'
         notification_body['headings']['en'] = 'Packets Start Today!'
         notification_body['send_after'] = start_date.strftime('%Y-%m-%d %H:%M:%S')
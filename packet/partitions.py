@@ -0,0 +1,85 @@
+"""
+Season partitions of the signature tables on Postgres
+
+The signature tables are range partitioned on packet_id with one partition per season. Packet ids only ever increase,
+so each season's packets occupy one contiguous id range and the newest season's partition is open ended (up to
+MAXVALUE). Queries that filter on a literal list of packet ids, like the selectin loads of Packet's signatures, only
+touch the partitions holding those ids. Queries that join packet to find their packets can't be pruned that way, so the
+member and leaderboard queries also filter on the packet id range of the season they're about (packet_id_range()).
+
+On other databases, and on Postgres databases that haven't run the partitioning migration, the tables are left as is.
+"""
+
+import re
+
+from . import db
+
+SIGNATURE_TABLES = ('signature_upper', 'signature_fresh', 'signature_misc')
+
+_OPEN_ENDED = re.compile(r'FROM \((\w+)\) TO \(MAXVALUE\)')
+
+
+def partition_name(table, season):
+    return '{}_p{}'.format(table, season.strftime('%Y%m%d'))
+
+
+def packet_id_range(column, packet_ids):
+    """
+    :param column: The packet_id column of a signature table
+    :return: A filter on the given column for the range of packet ids spanned by the given ones. A season's packets
+             have consecutive ids, so for the packets of one season this only matches that season's partition.
+    """
+    return column.between(min(packet_ids), max(packet_ids))
+
+
+def _partitions(table):
+    """
+    :return: A list of (partition name, partition bound) tuples for the given partitioned table
+    """
+    return db.session.execute('SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) FROM pg_inherits '
+                              'JOIN pg_class child ON child.oid = pg_inherits.inhrelid '
+                              'WHERE pg_inherits.inhparent = CAST(:table AS regclass)', {'table': table}).fetchall()
+
+
+def is_partitioned():
+    """
+    :return: Whether the signature tables are partitioned
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    return db.session.execute("SELECT count(*) FROM pg_partitioned_table JOIN pg_class ON pg_class.oid = partrelid "
+                              "WHERE relname = 'signature_upper'").scalar() > 0
+
+
+def create_season_partitions(season):
+    """
+    Gives a new season its own partition of each signature table. Run it before the season's packets are created. The
+    open ended partition of the previous season is capped at the next packet id and a new open ended partition takes
+    over from there. This commits on its own so the locks taken by the DDL are released before the season's rows are
+    written.
+    :return: The first packet id of the new partitions, or None if the tables aren't partitioned or the season already
+             has its partitions
+    """
+    if not is_partitioned() or partition_name(SIGNATURE_TABLES[0], season) in dict(_partitions(SIGNATURE_TABLES[0])):
+        return None
+
+    # Reserving an id guarantees every packet created after this gets a larger one
+    first_id = db.session.execute("SELECT nextval(pg_get_serial_sequence('packet', 'id'))").scalar()
+
+    for table in SIGNATURE_TABLES:
+        for name, bound in _partitions(table):
+            match = _OPEN_ENDED.search(bound)
+            if match is None:
+                continue
+
+            lower = match.group(1)
+            db.session.execute('ALTER TABLE {} DETACH PARTITION {}'.format(table, name))
+            db.session.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})'.format(
+                table, name, lower, first_id))
+
+        db.session.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO (MAXVALUE)'.format(
+            partition_name(table, season), table, first_id))
+
+    db.session.commit()
+    return first_id
@@ -0,0 +1,230 @@
+"""
+Opt-in request profiling
+
+Admins (see PROFILE_ADMINS) can profile a single request by adding ?profile=cprofile or ?profile=sample to its URL.
+Setting PROFILE_RATE above 0 also profiles that fraction of all requests with PROFILE_MODE. Results are written to
+PROFILE_DIR (a private directory in the instance folder by default), which is capped at PROFILE_MAX_FILES, and listed at
+/admin/profiles/.
+
+cprofile mode records every function call and writes a .pstats file for pstats, snakeviz, etc. sample mode has much
+lower overhead. It snapshots the stack of the request's thread (or greenlet, under gevent) every few milliseconds and
+writes the counts as collapsed stacks (.collapsed) for flamegraph.pl or speedscope.
+"""
+
+import cProfile
+import importlib
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, session
+
+from packet import app
+from packet.concurrency import async_mode
+from packet.local_files import instance_path, private_dir
+
+MODES = ('cprofile', 'sample')
+
+# Characters that aren't safe in profile file names
+_UNSAFE = re.compile(r'[^A-Za-z0-9_.-]+')
+
+
+def _native(module, name):
+    """
+    :return: The given function from before gevent's monkey patching, if it's been patched
+    """
+    if async_mode():
+        from gevent import monkey
+        return monkey.get_original(module, name)
+
+    return getattr(importlib.import_module(module), name)
+
+
+class SamplingProfiler:
+    """
+    Periodically records the stack of the thread that created it from a native background thread. Under gevent it
+    follows the greenlet that created it instead: while the greenlet is switched out its own saved frame is sampled,
+    and while it's running the stack of the OS thread it runs on is.
+    """
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = Counter()
+        self._greenlet = None
+        if async_mode():
+            import greenlet
+            self._greenlet = greenlet.getcurrent()
+        # The OS thread, which under gevent is shared by every greenlet in the worker
+        self._thread_id = _native('_thread', 'get_ident')()
+        self._running = False
+        self._done = _native('_thread', 'allocate_lock')()
+
+    def start(self):
+        self._running = True
+        self._done.acquire()
+        _native('_thread', 'start_new_thread')(self._run, ())
+
+    def stop(self):
+        self._running = False
+        # Blocks for at most one interval, even under gevent since the sampler is a native thread
+        self._done.acquire()
+        self._done.release()
+
+    def _run(self):
+        sleep = _native('time', 'sleep')
+        try:
+            while self._running:
+                sleep(self.interval)
+                self._sample()
+        finally:
+            self._done.release()
+
+    def _sample(self):
+        frame = self._greenlet.gr_frame if self._greenlet is not None else None
+        if frame is None:
+            frame = sys._current_frames().get(self._thread_id)  # pylint: disable=protected-access
+        if frame is None:
+            return
+
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        """
+        :return: The samples in the collapsed stack format, one "frame;frame;frame count" line per unique stack
+        """
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self.stacks.most_common())
+
+
+def is_admin(username):
+    return username in app.config['PROFILE_ADMINS']
+
+
+def _requested_mode():
+    """
+    :return: The profiling mode for the current request, or None
+    """
+    mode = request.args.get('profile')
+    if mode in MODES and 'userinfo' in session and \
+            is_admin(str(session['userinfo'].get('preferred_username', ''))):
+        return mode
+
+    if app.config['PROFILE_RATE'] > 0 and random.random() < app.config['PROFILE_RATE']:
+        return app.config['PROFILE_MODE']
+
+    return None
+
+
+def start_profiling():
+    """
+    Starts profiling the request if an admin asked for it or it was randomly picked
+    """
+    if request.endpoint == 'static':
+        return
+
+    mode = _requested_mode()
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif mode == 'sample':
+        profiler = SamplingProfiler()
+        profiler.start()
+    else:
+        return
+
+    g.profiler = (mode, profiler, time.time())
+
+
+def _stop(mode, profiler):
+    if mode == 'cprofile':
+        profiler.disable()
+    else:
+        profiler.stop()
+
+
+def profile_dir():
+    """
+    :return: The configured PROFILE_DIR, or a directory in the app's instance folder
+    """
+    return instance_path(app.config['PROFILE_DIR'], 'profiles')
+
+
+def stop_profiling(response):
+    """
+    Saves the request's profile to profile_dir()
+    """
+    if 'profiler' not in g:
+        return response
+
+    mode, profiler, start = g.pop('profiler')
+    _stop(mode, profiler)
+
+    milliseconds = int((time.time() - start) * 1000)
+    username = session.get('userinfo', {}).get('preferred_username', 'anonymous')
+    name = _UNSAFE.sub('_', '{}-{}ms-{}-{}'.format(datetime.now().strftime('%Y%m%d-%H%M%S-%f'), milliseconds,
+                                                   request.endpoint, username))
+
+    # Profiles include usernames and _prune() deletes from the directory, so it must be one only this user controls
+    if not private_dir(profile_dir()):
+        return response
+
+    try:
+        if mode == 'cprofile':
+            profiler.dump_stats(os.path.join(profile_dir(), name + '.pstats'))
+        else:
+            with open(os.path.join(profile_dir(), name + '.collapsed'), 'w') as profile_file:
+                profile_file.write(profiler.collapsed())
+        _prune()
+    except OSError as error:
+        app.logger.warning('Failed to save profile {}: {}'.format(name, error))
+        return response
+
+    app.logger.info('Saved {} profile of {} ({}ms) as {}'.format(mode, request.path, milliseconds, name))
+    return response
+
+
+@app.teardown_request
+def discard_profiling(exception=None):  # pylint: disable=unused-argument
+    """
+    Stops the profiler of a request that failed before stop_profiling() ran
+    """
+    if 'profiler' in g:
+        mode, profiler, _ = g.pop('profiler')
+        _stop(mode, profiler)
+
+
+def recent_profiles():
+    """
+    :return: A list of (file name, size in bytes, modification time) tuples, newest first
+    """
+    try:
+        entries = [entry for entry in os.scandir(profile_dir())
+                   if entry.is_file() and entry.name.endswith(('.pstats', '.collapsed'))]
+    except FileNotFoundError:
+        return []
+
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [(entry.name, entry.stat().st_size, datetime.fromtimestamp(entry.stat().st_mtime)) for entry in entries]
+
+
+def _prune():
+    """
+    Deletes the oldest profiles past PROFILE_MAX_FILES
+    """
+    for name, _, _ in recent_profiles()[app.config['PROFILE_MAX_FILES']:]:
+        try:
+            os.remove(os.path.join(profile_dir(), name))
+        except FileNotFoundError:
+            pass
+
+
+# Registered ahead of every other hook so the profile covers the whole request. after_request hooks run in reverse.
+app.before_request_funcs.setdefault(None, []).insert(0, start_profiling)
+app.after_request_funcs.setdefault(None, []).insert(0, stop_profiling)
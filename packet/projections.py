@@ -0,0 +1,192 @@
+"""
+Projections built by replaying the signature event log
+
+A SignatureProjection starts out empty and applies SignatureEvents as they're committed. Since the log is append-only,
+a projection only ever needs the events after the ones it already applied, so catching up is an indexed range query no
+matter how much history exists. It reads them through an EventCursor, so events that commit out of id order under
+concurrent writers are applied late rather than skipped. Replaying from the start rebuilds every count from scratch,
+which is how the analytics tables can be recomputed or checked (see the replay-events command).
+"""
+
+import threading
+from collections import Counter
+
+from . import db
+from .analytics import _as_date
+from .events import EventCursor
+from .models import Packet, SignatureEvent, SeasonStats, DailyStats, MemberSeasonStats, SigCounts, \
+    REQUIRED_MISC_SIGNATURES
+
+
+class PacketProjection:
+    """
+    The signature state of one packet as of the projection's last event
+    """
+    __slots__ = ['season', 'required', 'signed']
+
+    def __init__(self, season):
+        self.season = season
+        # Signature type to the usernames whose rows exist, and to the usernames that signed mapped to the sign date
+        self.required = {'upper': set(), 'fresh': set()}
+        self.signed = {'upper': {}, 'fresh': {}, 'misc': {}}
+
+    def signatures_required(self):
+        return SigCounts(len(self.required['upper']), len(self.required['fresh']), REQUIRED_MISC_SIGNATURES)
+
+    def signatures_received(self):
+        return SigCounts(len(self.signed['upper']), len(self.signed['fresh']), len(self.signed['misc']))
+
+    def is_100(self):
+        return self.signatures_required().total == self.signatures_received().total
+
+
+class SignatureProjection:
+    """
+    Per packet signature state plus the season, daily, and per member totals derived from it
+    """
+    def __init__(self):
+        self.cursor = EventCursor()
+        self.event_count = 0
+        self.packets = {}
+        self.seasons = {}
+        self.daily = Counter()
+        self.members = Counter()
+        self._lock = threading.Lock()
+
+    def _packet(self, event, starts):
+        packet = self.packets.get(event.packet_id)
+        if packet is None:
+            packet = self.packets[event.packet_id] = PacketProjection(_as_date(starts[event.packet_id]))
+            self._season(packet.season)['packets'] += 1
+        return packet
+
+    def _season(self, season):
+        if season not in self.seasons:
+            self.seasons[season] = Counter(packets=0, completed=0, upper=0, fresh=0, misc=0)
+        return self.seasons[season]
+
+    def _count_signature(self, packet, sig_type, username, day, delta):
+        self._season(packet.season)[sig_type] += delta
+        self.daily[(packet.season, day)] += delta
+        self.members[(packet.season, username, sig_type == 'fresh')] += delta
+
+    def apply(self, event, starts):
+        """
+        Applies a single event
+        :param starts: A dict of packet ids to start times, used for packets the projection hasn't seen yet
+        """
+        packet = self._packet(event, starts)
+        was_100 = packet.is_100()
+        signed = packet.signed[event.sig_type]
+
+        if event.action == 'require':
+            packet.required[event.sig_type].add(event.username)
+        elif event.action == 'sign':
+            if event.sig_type != 'misc':
+                packet.required[event.sig_type].add(event.username)
+            if event.username not in signed:
+                signed[event.username] = event.created.date()
+                self._count_signature(packet, event.sig_type, event.username, signed[event.username], 1)
+        elif event.action in ('unsign', 'drop'):
+            if event.action == 'drop':
+                packet.required[event.sig_type].discard(event.username)
+            if event.username in signed:
+                self._count_signature(packet, event.sig_type, event.username, signed.pop(event.username), -1)
+
+        if was_100 != packet.is_100():
+            self._season(packet.season)['completed'] += 1 if packet.is_100() else -1
+
+        self.event_count += 1
+
+    def catch_up(self, batch_size=10000):
+        """
+        Applies every event committed since the last catch up
+        :return: The number of events applied
+        """
+        with self._lock:
+            applied = 0
+            while True:
+                events = self.cursor.poll(SignatureEvent.packet_id, SignatureEvent.sig_type, SignatureEvent.username,
+                                          SignatureEvent.action, SignatureEvent.created, limit=batch_size)
+                if not events:
+                    return applied
+
+                new_ids = {event.packet_id for event in events} - set(self.packets)
+                starts = dict(db.session.query(Packet.id, Packet.start).filter(Packet.id.in_(new_ids))) \
+                    if new_ids else {}
+
+                for event in events:
+                    self.apply(event, starts)
+                applied += len(events)
+
+    # Readers
+
+    def signatures_required(self, packet_id):
+        """
+        Same contract as Packet.signatures_required()
+        """
+        return self.packets[packet_id].signatures_required()
+
+    def signatures_received(self, packet_id):
+        """
+        Same contract as Packet.signatures_received()
+        """
+        return self.packets[packet_id].signatures_received()
+
+    def analytics_rows(self):
+        """
+        :return: Unsaved SeasonStats, DailyStats, and MemberSeasonStats instances matching the projection
+        """
+        rows = [SeasonStats(season=season, packets=totals['packets'], completed=totals['completed'],
+                            upper_signatures=totals['upper'], fresh_signatures=totals['fresh'],
+                            misc_signatures=totals['misc']) for season, totals in self.seasons.items()]
+        rows.extend(DailyStats(season=season, day=day, signatures=signatures)
+                    for (season, day), signatures in self.daily.items() if signatures)
+        rows.extend(MemberSeasonStats(season=season, member=username, freshman=freshman, signatures=signatures)
+                    for (season, username, freshman), signatures in self.members.items() if signatures)
+        return rows
+
+
+def replay():
+    """
+    :return: A new SignatureProjection built from the whole event log
+    """
+    projection = SignatureProjection()
+    projection.catch_up()
+    return projection
+
+
+def write_analytics(projection):
+    """
+    Replaces the analytics tables with the projection's totals. The caller is responsible for committing.
+    """
+    for model in (SeasonStats, DailyStats, MemberSeasonStats):
+        model.query.delete(synchronize_session=False)
+
+    db.session.add_all(projection.analytics_rows())
+
+
+def compare_analytics(projection):
+    """
+    :return: A list of descriptions of the differences between the analytics tables and the projection
+    """
+    differences = []
+    columns = {'packets': 'packets', 'completed': 'completed', 'upper': 'upper_signatures',
+               'fresh': 'fresh_signatures', 'misc': 'misc_signatures'}
+
+    stored = {stats.season: stats for stats in SeasonStats.query.all()}
+    for season in sorted(set(stored) | set(projection.seasons)):
+        totals = projection.seasons.get(season, Counter())
+        for key, column in columns.items():
+            value = getattr(stored[season], column) if season in stored else 0
+            if value != totals[key]:
+                differences.append('{} {}: table has {}, events have {}'.format(season, column, value, totals[key]))
+
+    stored = {(row.season, row.member, row.freshman): row.signatures for row in MemberSeasonStats.query.all()}
+    replayed = {key: signatures for key, signatures in projection.members.items() if signatures}
+    for key in sorted(set(stored) | set(replayed), key=str):
+        if stored.get(key, 0) != replayed.get(key, 0):
+            differences.append('{} {} signatures: table has {}, events have {}'.format(
+                key[0], key[1], stored.get(key, 0), replayed.get(key, 0)))
+
+    return differences
@@ -0,0 +1,55 @@
+"""
+Request-scoped identity cache
+
+The model lookup helpers (Packet.by_id, Freshman.by_username) keep whatever they load in flask.g for the rest of the
+request, so helpers that need the same row (the onfloor check, RIT names, notifications) share a single query instead of
+each running their own. Misses are cached too. Nothing outlives the request, so there's nothing to invalidate.
+"""
+
+from collections import Counter
+
+from flask import g, has_request_context
+
+
+class RequestCache:
+    """
+    The entities loaded during one request, keyed by (kind, key)
+    """
+    def __init__(self):
+        self.entities = {}
+        self.hits = Counter()
+        self.misses = Counter()
+
+    def get(self, kind, key, load):
+        """
+        :param load: Called with no arguments to load the entity when it isn't cached yet
+        """
+        if (kind, key) in self.entities:
+            self.hits[kind] += 1
+        else:
+            self.misses[kind] += 1
+            self.entities[(kind, key)] = load()
+        return self.entities[(kind, key)]
+
+
+def request_cached(kind, key, load):
+    """
+    :return: The cached entity for the current request, loading it with load() the first time. Outside of a request
+             load() is always called.
+    """
+    if not has_request_context():
+        return load()
+
+    if 'request_cache' not in g:
+        g.request_cache = RequestCache()
+    return g.request_cache.get(kind, key, load)
+
+
+def request_cache_stats():
+    """
+    :return: A dict of each kind of entity to a (hits, misses) tuple for the current request
+    """
+    cache = g.get('request_cache') if has_request_context() else None
+    if cache is None:
+        return {}
+    return {kind: (cache.hits[kind], cache.misses[kind]) for kind in sorted(set(cache.hits) | set(cache.misses))}
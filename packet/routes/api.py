@@ -1,14 +1,57 @@
 """
 Shared API endpoints
 """
+from datetime import datetime
+
 from flask import request
+from sqlalchemy.orm import lazyload
 
 from packet import app, db
+from packet.analytics import record_signature, record_completion, season_summaries, daily_signatures, top_signers
+from packet.bulk import Operation, plan_operations, apply_plan
 from packet.context_processors import get_rit_name
 from packet.mail import send_report_mail
 from packet.utils import before_request, packet_auth, notify_slack
-from packet.models import Packet, MiscSignature, NotificationSubscription, Freshman
+from packet.models import Packet, MiscSignature, NotificationSubscription, Freshman, SignatureEvent
 from packet.notifications import packet_signed_notification, packet_100_percent_notification
+from packet.scoring import scores_from_db
+from packet.snapshots import score_packets
+
+
+def _packets_of(frosh):
+    """
+    :return: The freshman's packets, in the same order as Freshman.packets, without loading their signatures
+    """
+    return _packets_by_username([frosh.rit_username])[frosh.rit_username]
+
+
+def _packets_by_username(usernames):
+    """
+    :return: A dict of each username to their packets, in the same order as Freshman.packets, loaded with one query
+             and without their signatures
+    """
+    packets = {username: [] for username in usernames}
+    if not packets:
+        return packets
+
+    for packet in Packet.query.options(lazyload('*')).filter(Packet.freshman_username.in_(packets)) \
+            .order_by(Packet.id.desc()):
+        packets[packet.freshman_username].append(packet)
+    return packets
+
+
+def _packet_summary(packet):
+    return {
+        'start': packet.start,
+        'end': packet.end,
+        }
+
+
+def _packet_scores(scores, index):
+    return {
+        'required': vars(scores.required(index)),
+        'received': vars(scores.received(index)),
+        }
 
 
 @app.route('/api/v1/packets/<username>', methods=['GET'])
@@ -19,10 +62,7 @@ def get_packets_by_user(username: str) -> dict:
     """
     frosh = Freshman.by_username(username)
 
-    return {packet.id: {
-        'start': packet.start,
-        'end': packet.end,
-        } for packet in frosh.packets}
+    return {packet.id: _packet_summary(packet) for packet in _packets_of(frosh)}
 
 
 @app.route('/api/v1/packets/<username>/newest', methods=['GET'])
@@ -33,16 +73,10 @@ def get_newest_packet_by_user(username: str) -> dict:
     """
     frosh = Freshman.by_username(username)
 
-    packet = frosh.packets[-1]
+    packet = _packets_of(frosh)[-1]
+    scores = score_packets([packet.id])
 
-    return {
-            packet.id: {
-                'start': packet.start,
-                'end': packet.end,
-                'required': vars(packet.signatures_required()),
-                'received': vars(packet.signatures_received()),
-                }
-            }
+    return {packet.id: dict(_packet_summary(packet), **_packet_scores(scores, 0))}
 
 
 @app.route('/api/v1/packet/<packet_id>', methods=['GET'])
@@ -52,12 +86,59 @@ def get_packet_by_id(packet_id: int) -> dict:
     Return the scores of the packet in question
     """
 
-    packet = Packet.by_id(packet_id)
+    if db.session.query(Packet.id).filter_by(id=packet_id).scalar() is None:
+        return 'Invalid packet', 404
+
+    scores = score_packets([int(packet_id)])
+
+    return _packet_scores(scores, 0)
+
+
+@app.route('/api/v1/packets', methods=['GET'])
+@packet_auth
+def get_packets_by_users() -> dict:
+    """
+    Batch version of get_packets_by_user(). Takes the freshmen as repeated username args.
+    :return: A dictionary of each username to their packets' start and end dates by packet id
+    """
+    return {username: {packet.id: _packet_summary(packet) for packet in packets}
+            for username, packets in _packets_by_username(request.args.getlist('username')).items()}
+
+
+@app.route('/api/v1/packets/newest', methods=['GET'])
+@packet_auth
+def get_newest_packets_by_users() -> dict:
+    """
+    Batch version of get_newest_packet_by_user(). Takes the freshmen as repeated username args.
+    :return: A dictionary of each username to the same result as get_newest_packet_by_user(), or None if they have
+             no packets
+    """
+    newest = {username: packets[-1] if packets else None
+              for username, packets in _packets_by_username(request.args.getlist('username')).items()}
+    packet_ids = [packet.id for packet in newest.values() if packet is not None]
+    scores = score_packets(packet_ids)
+    positions = {packet_id: index for index, packet_id in enumerate(packet_ids)}
+
+    return {username: {packet.id: dict(_packet_summary(packet), **_packet_scores(scores, positions[packet.id]))}
+            if packet is not None else None for username, packet in newest.items()}
+
+
+@app.route('/api/v1/packet', methods=['GET'])
+@packet_auth
+def get_packets_by_ids() -> dict:
+    """
+    Batch version of get_packet_by_id(). Takes the packets as repeated id args.
+    :return: A dictionary of each packet id to the same result as get_packet_by_id(), or None if there's no such packet
+    """
+    requested = request.args.getlist('id', type=int)
+    packet_ids = [packet_id for packet_id, in db.session.query(Packet.id).filter(Packet.id.in_(requested))] \
+        if requested else []
+    scores = score_packets(packet_ids)
+    positions = {packet_id: index for index, packet_id in enumerate(packet_ids)}
+
+    return {packet_id: _packet_scores(scores, positions[packet_id]) if packet_id in positions else None
+            for packet_id in requested}
 
-    return {
-            'required': vars(packet.signatures_required()),
-            'received': vars(packet.signatures_received()),
-            }
 
 @app.route('/api/v1/sign/<packet_id>/', methods=['POST'])
 @packet_auth
@@ -70,17 +151,25 @@ def sign(packet_id, info):
         if app.config['REALM'] == 'csh':
             # Check if the CSHer is an upperclassman and if so, sign that row
             for sig in filter(lambda sig: sig.member == info['uid'], packet.upper_signatures):
+                if not sig.signed:
+                    record_signature(packet, info['uid'], 'upper')
+                    SignatureEvent.record(packet, 'upper', info['uid'], 'sign')
                 sig.signed = True
                 app.logger.info('Member {} signed packet {} as an upperclassman'.format(info['uid'], packet_id))
                 return commit_sig(packet, was_100, info['uid'])
 
             # The CSHer is a misc so add a new row
             db.session.add(MiscSignature(packet=packet, member=info['uid']))
+            record_signature(packet, info['uid'], 'misc')
+            SignatureEvent.record(packet, 'misc', info['uid'], 'sign')
             app.logger.info('Member {} signed packet {} as a misc'.format(info['uid'], packet_id))
             return commit_sig(packet, was_100, info['uid'])
         else:
             # Check if the freshman is onfloor and if so, sign that row
             for sig in filter(lambda sig: sig.freshman_username == info['uid'], packet.fresh_signatures):
+                if not sig.signed:
+                    record_signature(packet, info['uid'], 'fresh')
+                    SignatureEvent.record(packet, 'fresh', info['uid'], 'sign')
                 sig.signed = True
                 app.logger.info('Freshman {} signed packet {}'.format(info['uid'], packet_id))
                 return commit_sig(packet, was_100, info['uid'])
@@ -89,6 +178,51 @@ def sign(packet_id, info):
     return 'Error: Signature not valid.  Reason: Unknown'
 
 
+@app.route('/api/v1/sign/', methods=['POST'])
+@packet_auth
+@before_request
+def sign_many(info):
+    """
+    Signs every packet given as a repeated packet_id form field in one transaction
+    :return: A dictionary of each packet id to its status ('applied', 'skipped', or 'error') and a message
+    """
+    packet_ids = list(dict.fromkeys(request.form.getlist('packet_id', type=int)))
+    is_csh = app.config['REALM'] == 'csh'
+
+    # Validates every packet up front, with one query per chunk of packets
+    plan = plan_operations([Operation(index, 'sign', packet_id, info['uid'], is_csh)
+                            for index, packet_id in enumerate(packet_ids)])
+    results = {packet_ids[result.line]: {'status': result.status, 'message': result.message}
+               for result in plan.results}
+
+    signed = {packet_id: sig_type for packet_id, sig_type, _, _ in plan.events}
+    if not signed:
+        return results
+
+    packets = Packet.query.options(lazyload('*')).filter(Packet.id.in_(signed)).all()
+    before = scores_from_db(packet.id for packet in packets)
+    apply_plan(plan)
+    after = scores_from_db(before.packet_ids)
+
+    completed = []
+    for index, packet in enumerate(packets):
+        record_signature(packet, info['uid'], signed[packet.id])
+        # Queued per freshman and sent once the coalescing window closes
+        packet_signed_notification(packet, info['uid'])
+        if after.is_100[index] and not before.is_100[index]:
+            record_completion(packet)
+            completed.append((packet, Freshman.by_username(packet.freshman_username).name))
+    db.session.commit()
+
+    app.logger.info('{} {} signed packets {}'.format('Member' if is_csh else 'Freshman', info['uid'],
+                                                      ', '.join(map(str, signed))))
+    for packet, freshman_name in completed:
+        packet_100_percent_notification(packet)
+        notify_slack(freshman_name)
+
+    return results
+
+
 @app.route('/api/v1/subscribe/', methods=['POST'])
 @packet_auth
 @before_request
@@ -112,11 +246,44 @@ def report(info):
     return 'Success: ' + get_rit_name(info['uid']) + ' sent a report'
 
 
+@app.route('/api/v1/analytics', methods=['GET'])
+@packet_auth
+def get_analytics() -> dict:
+    """
+    Return the completion rate and signature totals of every season. Passing a season's start date (YYYY-MM-DD) as the
+    season arg adds the signatures per day and top signers for that season.
+    """
+    result = {str(stats.season): {
+        'packets': stats.packets,
+        'completed': stats.completed,
+        'completion_rate': stats.completion_rate(),
+        'upper_signatures': stats.upper_signatures,
+        'fresh_signatures': stats.fresh_signatures,
+        'misc_signatures': stats.misc_signatures,
+        } for stats in season_summaries()}
+
+    if 'season' in request.args:
+        try:
+            season = datetime.strptime(request.args['season'], '%Y-%m-%d').date()
+        except ValueError:
+            return 'Invalid season, expected YYYY-MM-DD', 400
+        result[str(season)] = dict(result.get(str(season), {}),
+                                   daily={str(day): signatures for day, signatures in daily_signatures(season)},
+                                   top_upperclassmen=top_signers(season),
+                                   top_freshmen=top_signers(season, freshmen=True))
+
+    return result
+
+
 def commit_sig(packet, was_100, uid):
     packet_signed_notification(packet, uid)
+    completed = not was_100 and packet.is_100()
+    if completed:
+        record_completion(packet)
+        freshman = Freshman.by_username(packet.freshman_username)
     db.session.commit()
-    if not was_100 and packet.is_100():
+    if completed:
         packet_100_percent_notification(packet)
-        notify_slack(packet.freshman.name)
+        notify_slack(freshman.name)
 
     return 'Success: Signed Packet: ' + packet.freshman_username
@@ -3,11 +3,14 @@ Routes available to both freshmen and CSH users
 """
 
 from flask import render_template, redirect
+from sqlalchemy.orm import lazyload
 
 from packet import auth, app
 from packet.utils import before_request, packet_auth
-from packet.models import Packet
-from packet.log_utils import log_cache, log_time
+from packet.models import Packet, PacketSnapshot
+from packet.log_utils import log_cache, log_slow, log_time
+from packet.sigmatrix import signature_matrix
+from packet.static_assets import send_precompressed
 
 
 @app.route('/logout/')
@@ -20,9 +23,11 @@ def logout():
 @log_cache
 @packet_auth
 @before_request
+@log_slow
 @log_time
 def freshman_packet(packet_id, info=None):
-    packet = Packet.by_id(packet_id)
+    # The signatures are only loaded if they're needed, which they aren't for closed packets with a snapshot
+    packet = Packet.query.options(lazyload('*')).filter_by(id=packet_id).first()
 
     if packet is None:
         return 'Invalid packet or freshman', 404
@@ -34,38 +39,60 @@ def freshman_packet(packet_id, info=None):
             if info['uid'] not in map(lambda sig: sig.freshman_username, packet.fresh_signatures):
                 can_sign = False
 
+        # Open packets are scored from memory, closed ones from their snapshot, and closed ones that haven't been
+        # snapshotted yet fall back to their signature rows
+        matrix = signature_matrix()
+        is_csh = app.config['REALM'] == 'csh'
+        snapshot = None if matrix.is_open(packet.id) else PacketSnapshot.query.get(packet.id)
+        if snapshot is not None:
+            did_sign = snapshot.did_sign(info['uid'], is_csh)
+            required = snapshot.signatures_required()
+            received = snapshot.signatures_received()
+            upper, fresh, misc = snapshot.upper_signatures(), snapshot.fresh_signatures(), snapshot.misc_signatures()
+        else:
+            if matrix.is_open(packet.id):
+                did_sign = matrix.did_sign(packet.id, info['uid'], is_csh)
+                required = matrix.signatures_required(packet.id)
+                received = matrix.signatures_received(packet.id)
+            else:
+                did_sign = packet.did_sign(info['uid'], is_csh)
+                required = packet.signatures_required()
+                received = packet.signatures_received()
+            upper, fresh, misc = packet.upper_signatures, packet.fresh_signatures, packet.misc_signatures
+
         return render_template('packet.html',
                                info=info,
                                packet=packet,
                                can_sign=can_sign,
-                               did_sign=packet.did_sign(info['uid'], app.config['REALM'] == 'csh'),
-                               required=packet.signatures_required(),
-                               received=packet.signatures_received(),
-                               upper=packet.upper_signatures)
-
-
-def packet_sort_key(packet):
-    """
-    Utility function for generating keys for sorting packets
-    """
-    return packet.signatures_received_result.total, packet.did_sign_result
+                               did_sign=did_sign,
+                               required=required,
+                               received=received,
+                               upper=upper,
+                               fresh=fresh,
+                               misc=misc)
 
 
 @app.route('/packets/')
 @log_cache
 @packet_auth
 @before_request
+@log_slow
 @log_time
 def packets(info=None):
-    open_packets = Packet.open_packets()
+    matrix = signature_matrix()
+    packets_by_id = {packet.id: packet for packet in matrix.open_packets()}
 
-    # Pre-calculate and store the return values of did_sign(), signatures_received(), and signatures_required()
-    for packet in open_packets:
-        packet.did_sign_result = packet.did_sign(info['uid'], app.config['REALM'] == 'csh')
-        packet.signatures_received_result = packet.signatures_received()
-        packet.signatures_required_result = packet.signatures_required()
+    # Score and rank every open packet in one pass
+    scores = matrix.scores()
+    did_sign = matrix.did_sign_all(info['uid'], app.config['REALM'] == 'csh')
 
-    open_packets.sort(key=packet_sort_key, reverse=True)
+    open_packets = []
+    for index in scores.ranking(did_sign):
+        packet = packets_by_id[scores.packet_ids[index]]
+        packet.did_sign_result = bool(did_sign[index])
+        packet.signatures_received_result = scores.received(index)
+        packet.signatures_required_result = scores.required(index)
+        open_packets.append(packet)
 
     return render_template('active_packets.html', info=info, packets=open_packets)
 
@@ -73,10 +100,10 @@ def packets(info=None):
 @app.route('/sw.js', methods=['GET'])
 @app.route('/OneSignalSDKWorker.js', methods=['GET'])
 def service_worker():
-    return app.send_static_file('js/sw.js')
+    return send_precompressed('js/sw.js', max_age=0)
 
 
 @app.route('/update-sw.js', methods=['GET'])
 @app.route('/OneSignalSDKUpdaterWorker.js', methods=['GET'])
 def update_service_worker():
-    return app.send_static_file('js/update-sw.js')
+    return send_precompressed('js/update-sw.js', max_age=0)
@@ -2,14 +2,14 @@
 Routes available to CSH users only
 """
 
-from itertools import chain
 from operator import itemgetter
-from flask import redirect, render_template, url_for
+from flask import redirect, render_template, url_for, send_from_directory
 
 from packet import app
-from packet.models import Packet, MiscSignature
+from packet.profiling import is_admin, profile_dir, recent_profiles
 from packet.utils import before_request, packet_auth
-from packet.log_utils import log_cache, log_time
+from packet.log_utils import log_cache, log_slow, log_time
+from packet.sigmatrix import signature_matrix
 
 
 @app.route('/')
@@ -22,13 +22,15 @@ def index():
 @log_cache
 @packet_auth
 @before_request
+@log_slow
 @log_time
 def upperclassman(uid, info=None):
-    open_packets = Packet.open_packets()
+    matrix = signature_matrix()
+    open_packets = matrix.open_packets()
 
     # Pre-calculate and store the return value of did_sign()
     for packet in open_packets:
-        packet.did_sign_result = packet.did_sign(uid, True)
+        packet.did_sign_result = matrix.did_sign(packet.id, uid, True)
 
     signatures = sum(map(lambda packet: 1 if packet.did_sign_result else 0, open_packets))
 
@@ -43,21 +45,33 @@ def upperclassman(uid, info=None):
 @log_cache
 @packet_auth
 @before_request
+@log_slow
 @log_time
 def upperclassmen_total(info=None):
-    open_packets = Packet.open_packets()
+    matrix = signature_matrix()
 
-    # Sum up the signed packets per upperclassman
-    upperclassmen = dict()
-    for packet in open_packets:
-        for sig in chain(packet.upper_signatures, packet.misc_signatures):
-            if sig.member not in upperclassmen:
-                upperclassmen[sig.member] = 0
-
-            if isinstance(sig, MiscSignature):
-                upperclassmen[sig.member] += 1
-            elif sig.signed:
-                upperclassmen[sig.member] += 1
+    # The matrix keeps a running count of the signed packets per upperclassman
+    upperclassmen = matrix.member_totals()
 
-    return render_template('upperclassmen_totals.html', info=info, num_open_packets=len(open_packets),
+    return render_template('upperclassmen_totals.html', info=info, num_open_packets=len(matrix.open_packet_ids()),
                            upperclassmen=sorted(upperclassmen.items(), key=itemgetter(1), reverse=True))
+
+
+@app.route('/admin/profiles/')
+@packet_auth
+@before_request
+def profiles(info=None):
+    if not is_admin(info['uid']):
+        return 'Forbidden', 403
+
+    return render_template('admin_profiles.html', info=info, profiles=recent_profiles())
+
+
+@app.route('/admin/profiles/<name>')
+@packet_auth
+@before_request
+def download_profile(name, info=None):
+    if not is_admin(info['uid']):
+        return 'Forbidden', 403
+
+    return send_from_directory(profile_dir(), name, as_attachment=True, cache_timeout=0)
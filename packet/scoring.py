@@ -0,0 +1,97 @@
+"""
+Vectorized packet scoring
+
+Signature counts for any number of packets are held as aligned NumPy arrays so the capped totals, percentages, and
+sort orders for all of them are computed in one pass. The views, API, and CLI exports all score through here.
+"""
+
+import numpy as np
+from sqlalchemy import func, case
+
+from . import db
+from .models import UpperSignature, FreshSignature, MiscSignature, SigCounts, REQUIRED_MISC_SIGNATURES
+
+
+class PacketScores:
+    """
+    Signature counts and derived scores for a batch of packets. Every array is aligned with packet_ids.
+    """
+    def __init__(self, packet_ids, upper_received, upper_required, fresh_received, fresh_required, misc_received):
+        self.packet_ids = list(packet_ids)
+
+        # Base fields
+        self.upper_received = np.asarray(upper_received, dtype=np.int64)
+        self.upper_required = np.asarray(upper_required, dtype=np.int64)
+        self.fresh_received = np.asarray(fresh_received, dtype=np.int64)
+        self.fresh_required = np.asarray(fresh_required, dtype=np.int64)
+        self.misc_received = np.asarray(misc_received, dtype=np.int64)
+
+        # Misc signatures only count up to REQUIRED_MISC_SIGNATURES
+        self.misc_capped = np.minimum(self.misc_received, REQUIRED_MISC_SIGNATURES)
+
+        # Totals (calculated using misc_capped)
+        self.received_member_total = self.upper_received + self.misc_capped
+        self.received_total = self.received_member_total + self.fresh_received
+        self.required_member_total = self.upper_required + REQUIRED_MISC_SIGNATURES
+        self.required_total = self.required_member_total + self.fresh_required
+
+        # Percentages
+        self.member_percent = self.received_member_total / self.required_member_total * 100
+        self.total_percent = self.received_total / self.required_total * 100
+        self.is_100 = self.received_total == self.required_total
+
+    def __len__(self):
+        return len(self.packet_ids)
+
+    def received(self, index):
+        """
+        :return: A SigCounts instance equivalent to Packet.signatures_received() for the packet at index
+        """
+        return SigCounts(int(self.upper_received[index]), int(self.fresh_received[index]),
+                         int(self.misc_received[index]))
+
+    def required(self, index):
+        """
+        :return: A SigCounts instance equivalent to Packet.signatures_required() for the packet at index
+        """
+        return SigCounts(int(self.upper_required[index]), int(self.fresh_required[index]), REQUIRED_MISC_SIGNATURES)
+
+    def ranking(self, did_sign=None):
+        """
+        Orders the packets by total signatures received, most first, with ties going to the packets the viewer has
+        signed. Packets that are still tied keep their original order.
+        :param did_sign: An optional array of booleans aligned with packet_ids
+        :return: An array of indexes
+        """
+        if did_sign is None:
+            did_sign = np.zeros(len(self), dtype=bool)
+
+        # lexsort sorts by the last key first and is stable
+        return np.lexsort((-np.asarray(did_sign, dtype=np.int64), -self.received_total))
+
+
+def _signed_count(sig_model):
+    return func.sum(case([(sig_model.signed, 1)], else_=0))
+
+
+def scores_from_db(packet_ids):
+    """
+    Scores the given packets with one grouped query per signature table
+    :return: A PacketScores instance aligned with packet_ids
+    """
+    packet_ids = list(packet_ids)
+    positions = {packet_id: index for index, packet_id in enumerate(packet_ids)}
+    counts = np.zeros((5, len(packet_ids)), dtype=np.int64)
+
+    if packet_ids:
+        for row, sig_model in ((0, UpperSignature), (2, FreshSignature)):
+            for packet_id, received, required in db.session.query(sig_model.packet_id, _signed_count(sig_model),
+                                                                  func.count()) \
+                    .filter(sig_model.packet_id.in_(packet_ids)).group_by(sig_model.packet_id):
+                counts[row:row + 2, positions[packet_id]] = (received or 0, required)
+
+        for packet_id, received in db.session.query(MiscSignature.packet_id, func.count()) \
+                .filter(MiscSignature.packet_id.in_(packet_ids)).group_by(MiscSignature.packet_id):
+            counts[4, positions[packet_id]] = received
+
+    return PacketScores(packet_ids, *counts)
@@ -0,0 +1,316 @@
+"""
+Process-level in-memory index of the signatures on all open packets
+
+Members and freshmen are interned to small integers and each open packet stores its signatures as packed bitsets (plain
+Python ints) over those indexes. The matrix is built from the DB once and then kept current at most once per request
+by polling the SignatureEvent log: only the signatures named by new events are re-read. Packets opening or closing
+rebuild it. Each sync produces a new MatrixState instead of modifying the one readers may be using.
+"""
+
+import sys
+from datetime import datetime
+from threading import RLock
+
+import numpy as np
+from flask import g, has_request_context
+from sqlalchemy.orm import lazyload
+
+from packet import app, db
+from packet.cache import on_data_version_change
+from packet.events import EventCursor
+from packet.models import Packet, UpperSignature, FreshSignature, MiscSignature, SignatureEvent, SigCounts, \
+    REQUIRED_MISC_SIGNATURES
+from packet.partitions import packet_id_range
+from packet.scoring import PacketScores
+
+
+def _bit_count(bits):
+    return bin(bits).count('1')
+
+
+class _PacketRow:
+    """
+    The signature bitsets of a single open packet
+    """
+    __slots__ = ('freshman_username', 'upper_required', 'upper_signed', 'misc_signed', 'fresh_required',
+                 'fresh_signed')
+
+    def __init__(self, freshman_username):
+        self.freshman_username = freshman_username
+        self.upper_required = 0
+        self.upper_signed = 0
+        self.misc_signed = 0
+        self.fresh_required = 0
+        self.fresh_signed = 0
+
+    def copy(self):
+        row = _PacketRow(self.freshman_username)
+        for attr in _PacketRow.__slots__[1:]:
+            setattr(row, attr, getattr(self, attr))
+        return row
+
+
+class MatrixState:
+    """
+    Open packets × signers, answered from memory. A state is never modified once SignatureMatrix.sync() has returned
+    it, so a request can keep reading the same one while other threads sync.
+    """
+    def __init__(self, packet_ids=()):
+        self._packet_ids = packet_ids
+        self._rows = {}
+        self._members = {}
+        self._freshmen = {}
+        self._member_counts = []
+
+    @classmethod
+    def load(cls, packet_ids):
+        """
+        :return: A new state with the signatures of the given open packets
+        """
+        state = cls(packet_ids)
+        if packet_ids:
+            for packet_id, freshman_username in db.session.query(Packet.id, Packet.freshman_username) \
+                    .filter(Packet.id.in_(packet_ids)):
+                state._rows[packet_id] = _PacketRow(freshman_username)
+
+            # The open packets are the current season's, so the range keeps these on its partition
+            for load, sig_model in ((state._load_upper, UpperSignature), (state._load_misc, MiscSignature),
+                                    (state._load_fresh, FreshSignature)):
+                load(packet_id_range(sig_model.packet_id, packet_ids), sig_model.packet_id.in_(packet_ids))
+
+        app.logger.info('Signature matrix rebuilt with {} packets, {} members, and {} freshmen ({} bytes)'.format(
+            len(state._rows), len(state._members), len(state._freshmen), state.memory_usage()))
+        return state
+
+    def updated(self, changed):
+        """
+        :param changed: A dict of sig_type ('upper', 'fresh', or 'misc') to a set of (packet_id, username) tuples
+        :return: A new state with the given signatures re-read from the DB, sharing nothing mutable with this one
+        """
+        state = MatrixState(self._packet_ids)
+        state._rows = dict(self._rows)
+        for packet_id in {packet_id for keys in changed.values() for packet_id, _ in keys}:
+            state._rows[packet_id] = self._rows[packet_id].copy()
+        state._members = dict(self._members)
+        state._freshmen = dict(self._freshmen)
+        state._member_counts = list(self._member_counts)
+
+        state._reload(changed)
+        return state
+
+    # Interning
+
+    def _member_index(self, username):
+        index = self._members.get(username)
+        if index is None:
+            index = self._members[username] = len(self._members)
+            self._member_counts.append(0)
+        return index
+
+    def _freshman_index(self, username):
+        index = self._freshmen.get(username)
+        if index is None:
+            index = self._freshmen[username] = len(self._freshmen)
+        return index
+
+    # Loading
+
+    def _reload(self, changed):
+        """
+        Re-reads the given signatures from the DB. Rows that no longer exist (dropped requirements and unsigned misc
+        signatures) are cleared.
+        """
+        for sig_type, keys in changed.items():
+            for packet_id, username in keys:
+                row = self._rows[packet_id]
+                if sig_type == 'fresh':
+                    mask = ~(1 << self._freshman_index(username))
+                    row.fresh_required &= mask
+                    row.fresh_signed &= mask
+                else:
+                    index = self._member_index(username)
+                    for attr in ('upper_required', 'upper_signed') if sig_type == 'upper' else ('misc_signed',):
+                        self._set_member_bit(row, attr, index, False)
+
+        # Filtering on the packets and usernames separately may match a few unchanged rows, which is harmless since
+        # loading a row is idempotent
+        for sig_type, sig_model, username_column, load in (
+                ('upper', UpperSignature, UpperSignature.member, self._load_upper),
+                ('fresh', FreshSignature, FreshSignature.freshman_username, self._load_fresh),
+                ('misc', MiscSignature, MiscSignature.member, self._load_misc)):
+            keys = changed.get(sig_type)
+            if keys:
+                load(sig_model.packet_id.in_({packet_id for packet_id, _ in keys}),
+                     username_column.in_({username for _, username in keys}))
+
+    def _set_member_bit(self, row, attr, index, value):
+        bits = getattr(row, attr)
+        mask = 1 << index
+        if bool(bits & mask) != value:
+            setattr(row, attr, bits ^ mask)
+            if attr != 'upper_required':
+                self._member_counts[index] += 1 if value else -1
+
+    def _load_upper(self, *criteria):
+        for packet_id, member, signed in db.session.query(UpperSignature.packet_id, UpperSignature.member,
+                                                          UpperSignature.signed).filter(*criteria):
+            row = self._rows[packet_id]
+            index = self._member_index(member)
+            self._set_member_bit(row, 'upper_required', index, True)
+            self._set_member_bit(row, 'upper_signed', index, signed)
+
+    def _load_misc(self, *criteria):
+        for packet_id, member in db.session.query(MiscSignature.packet_id, MiscSignature.member).filter(*criteria):
+            self._set_member_bit(self._rows[packet_id], 'misc_signed', self._member_index(member), True)
+
+    def _load_fresh(self, *criteria):
+        for packet_id, freshman_username, signed in db.session.query(
+                FreshSignature.packet_id, FreshSignature.freshman_username, FreshSignature.signed).filter(*criteria):
+            row = self._rows[packet_id]
+            mask = 1 << self._freshman_index(freshman_username)
+            row.fresh_required |= mask
+            row.fresh_signed = row.fresh_signed | mask if signed else row.fresh_signed & ~mask
+
+    # Queries
+
+    def open_packet_ids(self):
+        return self._packet_ids
+
+    def open_packets(self):
+        """
+        :return: Packet instances for the open packets without their signatures loaded
+        """
+        if not self._packet_ids:
+            return []
+
+        return Packet.query.options(lazyload('*')).filter(Packet.id.in_(self._packet_ids)).all()
+
+    def is_open(self, packet_id):
+        return packet_id in self._rows
+
+    def did_sign(self, packet_id, username, is_csh):
+        """
+        Same contract as Packet.did_sign()
+        """
+        row = self._rows[packet_id]
+        if is_csh:
+            index = self._members.get(username)
+            return index is not None and bool((row.upper_signed | row.misc_signed) >> index & 1)
+        else:
+            index = self._freshmen.get(username)
+            return index is not None and bool(row.fresh_signed >> index & 1)
+
+    def signatures_required(self, packet_id):
+        """
+        Same contract as Packet.signatures_required()
+        """
+        row = self._rows[packet_id]
+        return SigCounts(_bit_count(row.upper_required), _bit_count(row.fresh_required), REQUIRED_MISC_SIGNATURES)
+
+    def signatures_received(self, packet_id):
+        """
+        Same contract as Packet.signatures_received()
+        """
+        row = self._rows[packet_id]
+        return SigCounts(_bit_count(row.upper_signed), _bit_count(row.fresh_signed), _bit_count(row.misc_signed))
+
+    def did_sign_all(self, username, is_csh):
+        """
+        :return: An array of did_sign() results aligned with open_packet_ids()
+        """
+        return np.fromiter((self.did_sign(packet_id, username, is_csh) for packet_id in self._packet_ids), dtype=bool,
+                           count=len(self._packet_ids))
+
+    def scores(self):
+        """
+        :return: A PacketScores instance aligned with open_packet_ids()
+        """
+        rows = [self._rows[packet_id] for packet_id in self._packet_ids]
+        return PacketScores(self._packet_ids,
+                            [_bit_count(row.upper_signed) for row in rows],
+                            [_bit_count(row.upper_required) for row in rows],
+                            [_bit_count(row.fresh_signed) for row in rows],
+                            [_bit_count(row.fresh_required) for row in rows],
+                            [_bit_count(row.misc_signed) for row in rows])
+
+    def member_totals(self):
+        """
+        :return: A dict of CSH usernames to the number of open packets they've signed
+        """
+        return {member: self._member_counts[index] for member, index in self._members.items()}
+
+    def memory_usage(self):
+        """
+        :return: The approximate number of bytes used by the matrix
+        """
+        total = sum(map(sys.getsizeof, (self._rows, self._members, self._freshmen, self._member_counts)))
+        total += sum(map(sys.getsizeof, self._members)) + sum(map(sys.getsizeof, self._freshmen))
+        for row in self._rows.values():
+            total += sys.getsizeof(row) + sum(sys.getsizeof(getattr(row, attr)) for attr in _PacketRow.__slots__)
+        return total
+
+
+class SignatureMatrix:
+    """
+    The process' current MatrixState, kept up to date with the signature event log
+    """
+    def __init__(self):
+        self._lock = RLock()
+        self._state = None
+        self._cursor = EventCursor()
+
+    @staticmethod
+    def _open_packet_ids():
+        now = datetime.now()
+        return tuple(packet_id for packet_id, in db.session.query(Packet.id)
+                     .filter(Packet.start < now, Packet.end > now).order_by(Packet.id))
+
+    def sync(self):
+        """
+        Brings the matrix up to date with the DB. Packets opening or closing rebuild it, otherwise only the signatures
+        named by the events logged since the last sync are re-read.
+        :return: The up to date MatrixState
+        """
+        # The event cursor's position only makes sense against one database, and the primary never lags
+        with self._lock, db.use_primary():
+            packet_ids = self._open_packet_ids()
+
+            if self._state is None or packet_ids != self._state.open_packet_ids():
+                # Started first so the changes committed while the state is loaded are re-read by the next sync
+                self._cursor.start()
+                self._state = MatrixState.load(packet_ids)
+            else:
+                changed = {}
+                for _, packet_id, sig_type, username in self._cursor.poll(
+                        SignatureEvent.packet_id, SignatureEvent.sig_type, SignatureEvent.username):
+                    if self._state.is_open(packet_id):
+                        changed.setdefault(sig_type, set()).add((packet_id, username))
+
+                if changed:
+                    self._state = self._state.updated(changed)
+
+            return self._state
+
+    def reset(self):
+        """
+        Forces a full rebuild on the next sync
+        """
+        with self._lock:
+            self._state = None
+
+
+_matrix = SignatureMatrix()
+on_data_version_change('packet', _matrix.reset)
+
+
+def signature_matrix():
+    """
+    :return: The process' MatrixState, synced with the DB at most once per request. Every call during a request returns
+             the same state.
+    """
+    if not has_request_context():
+        return _matrix.sync()
+
+    if 'signature_matrix' not in g:
+        g.signature_matrix = _matrix.sync()
+    return g.signature_matrix
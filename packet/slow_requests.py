@@ -0,0 +1,162 @@
+"""
+Captures the SQL behind slow requests
+
+Views decorated with log_utils.log_slow record every statement they run. When one takes longer than
+SLOW_REQUEST_THRESHOLD seconds the route, arguments, timing breakdown, statements, and the query plans of the slowest
+statements are saved to a ring buffer of the last SLOW_REQUEST_BUFFER records. The plans are fetched once the response
+has been sent so a slow request isn't slowed down further. The buffer is a SQLite file shared by the workers on the
+host, kept in the instance folder by default and only used when no other user can access it. It can be read with
+`flask slow-requests`.
+"""
+
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from packet import app
+from packet.local_files import instance_path, private_file
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, *_):
+    if has_app_context() and g.get('sql_capture') is not None:
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):  # pylint: disable=unused-argument
+    if has_app_context() and g.get('sql_capture') is not None and conn.info.get('query_start'):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        g.sql_capture.append({'statement': statement, 'parameters': parameters, 'executemany': executemany,
+                              'seconds': seconds, 'engine': conn.engine})
+
+
+def start_capture():
+    g.sql_capture = []
+
+
+def stop_capture():
+    """
+    :return: The statements run since start_capture()
+    """
+    return g.pop('sql_capture', None) or []
+
+
+def _explain_prefix(engine):
+    if engine.dialect.name == 'sqlite':
+        return 'EXPLAIN QUERY PLAN '
+    elif engine.dialect.name == 'postgresql' and app.config['SLOW_REQUEST_EXPLAIN_ANALYZE']:
+        return 'EXPLAIN ANALYZE '
+    return 'EXPLAIN '
+
+
+def explain(query):
+    """
+    Runs EXPLAIN for a captured SELECT statement on the engine that ran it
+    :return: The plan as a list of lines
+    """
+    connection = query['engine'].raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(_explain_prefix(query['engine']) + query['statement'], query['parameters'])
+        return [' | '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except Exception as error:  # pylint: disable=broad-except
+        return ['EXPLAIN failed: {}'.format(error)]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def build_record(route, arguments, total, queries):
+    """
+    :return: A JSON serializable description of a slow request
+    """
+    sql_seconds = sum(query['seconds'] for query in queries)
+    slowest = sorted((query for query in queries if query['statement'].lstrip().upper().startswith('SELECT')
+                      and not query['executemany']), key=lambda query: query['seconds'],
+                     reverse=True)[:app.config['SLOW_REQUEST_EXPLAIN']]
+
+    return {
+        'recorded': datetime.now().isoformat(),
+        'route': route,
+        'arguments': {key: repr(value) for key, value in arguments.items()},
+        'timing': {'total': total, 'sql': sql_seconds, 'other': total - sql_seconds, 'statements': len(queries)},
+        'queries': [{'statement': query['statement'], 'parameters': repr(query['parameters'])[:500],
+                     'seconds': query['seconds']} for query in queries],
+        'plans': [{'statement': query['statement'], 'seconds': query['seconds'], 'plan': explain(query)}
+                  for query in slowest],
+    }
+
+
+class RingBuffer:
+    """
+    Keeps the most recent records in a SQLite file that only the app's user can access
+    """
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self._usable = None
+
+    def _con(self):
+        """
+        :return: A connection to the buffer's file, or None if the file isn't safe to use
+        """
+        if self._usable is None:
+            self._usable = private_file(self.path)
+        if not self._usable:
+            return None
+
+        con = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        con.execute('PRAGMA journal_mode=WAL')
+        con.execute('CREATE TABLE IF NOT EXISTS slow_request (id INTEGER PRIMARY KEY AUTOINCREMENT, recorded TEXT, '
+                    'record TEXT)')
+        return con
+
+    def append(self, record):
+        con = self._con()
+        if con is None:
+            return
+
+        try:
+            con.execute('INSERT INTO slow_request (recorded, record) VALUES (?, ?)',
+                        (record['recorded'], json.dumps(record)))
+            con.execute('DELETE FROM slow_request WHERE id <= (SELECT max(id) FROM slow_request) - ?', (self.size,))
+        finally:
+            con.close()
+
+    def recent(self, limit):
+        """
+        :return: A list of (id, record) tuples, newest first
+        """
+        con = self._con()
+        if con is None:
+            return []
+
+        try:
+            return [(row[0], json.loads(row[1])) for row in
+                    con.execute('SELECT id, record FROM slow_request ORDER BY id DESC LIMIT ?', (limit,))]
+        finally:
+            con.close()
+
+    def get(self, record_id):
+        """
+        :return: The record with the given id, or None
+        """
+        con = self._con()
+        if con is None:
+            return None
+
+        try:
+            row = con.execute('SELECT record FROM slow_request WHERE id = ?', (record_id,)).fetchone()
+            return json.loads(row[0]) if row is not None else None
+        finally:
+            con.close()
+
+
+slow_requests = RingBuffer(instance_path(app.config['SLOW_REQUEST_PATH'], 'packet-slow-requests.sqlite3'),
+                           app.config['SLOW_REQUEST_BUFFER'])
@@ -0,0 +1,94 @@
+"""
+Frozen results of closed packets
+
+Nothing can change a packet's signatures after its end, so the close-packets command copies each closed packet's final
+counts and signer lists into a PacketSnapshot. Reads of closed packets are then answered from that one row instead of
+rescoring the signature tables.
+"""
+
+from datetime import datetime
+
+import numpy as np
+
+from . import db
+from .models import Packet, PacketSnapshot, UpperSignature, FreshSignature, MiscSignature
+from .scoring import PacketScores, scores_from_db
+
+# The number of packets snapshotted per batch of queries
+_BATCH_SIZE = 500
+
+
+def _signers(packet_ids):
+    """
+    :return: A dict of packet ids to signers dicts for PacketSnapshot
+    """
+    signers = {packet_id: {'upper': [], 'fresh': [], 'misc': []} for packet_id in packet_ids}
+
+    for sig in UpperSignature.query.filter(UpperSignature.packet_id.in_(packet_ids)) \
+            .order_by(UpperSignature.signed.desc(), UpperSignature.updated):
+        signers[sig.packet_id]['upper'].append([sig.member, sig.signed, sig.eboard, sig.roles])
+
+    for sig in FreshSignature.query.filter(FreshSignature.packet_id.in_(packet_ids)) \
+            .order_by(FreshSignature.signed.desc(), FreshSignature.updated):
+        signers[sig.packet_id]['fresh'].append([sig.freshman_username, sig.signed])
+
+    for sig in MiscSignature.query.filter(MiscSignature.packet_id.in_(packet_ids)).order_by(MiscSignature.updated):
+        signers[sig.packet_id]['misc'].append(sig.member)
+
+    return signers
+
+
+def snapshot_closed_packets():
+    """
+    Snapshots every packet that has ended and doesn't have a snapshot yet. The caller is responsible for committing.
+    :return: The number of packets snapshotted
+    """
+    packet_ids = [packet_id for packet_id, in db.session.query(Packet.id)
+                  .outerjoin(PacketSnapshot, PacketSnapshot.packet_id == Packet.id)
+                  .filter(Packet.end <= datetime.now(), PacketSnapshot.packet_id.is_(None))]
+
+    for start in range(0, len(packet_ids), _BATCH_SIZE):
+        batch = packet_ids[start:start + _BATCH_SIZE]
+        scores = scores_from_db(batch)
+        signers = _signers(batch)
+
+        for index, packet_id in enumerate(scores.packet_ids):
+            db.session.add(PacketSnapshot(packet_id=packet_id,
+                                          upper_received=int(scores.upper_received[index]),
+                                          upper_required=int(scores.upper_required[index]),
+                                          fresh_received=int(scores.fresh_received[index]),
+                                          fresh_required=int(scores.fresh_required[index]),
+                                          misc_received=int(scores.misc_received[index]),
+                                          signers=signers[packet_id]))
+
+    return len(packet_ids)
+
+
+def score_packets(packet_ids):
+    """
+    Scores packets from their snapshots where they have one and from the signature tables otherwise
+    :return: A PacketScores instance aligned with packet_ids
+    """
+    packet_ids = list(packet_ids)
+    snapshots = {snapshot.packet_id: snapshot for snapshot in
+                 PacketSnapshot.query.filter(PacketSnapshot.packet_id.in_(packet_ids))} if packet_ids else {}
+
+    live_ids = [packet_id for packet_id in packet_ids if packet_id not in snapshots]
+    live = scores_from_db(live_ids)
+    if not snapshots:
+        return live
+
+    counts = np.zeros((5, len(packet_ids)), dtype=np.int64)
+    live_positions = {packet_id: index for index, packet_id in enumerate(live.packet_ids)}
+    for index, packet_id in enumerate(packet_ids):
+        if packet_id in snapshots:
+            snapshot = snapshots[packet_id]
+            counts[:, index] = (snapshot.upper_received, snapshot.upper_required, snapshot.fresh_received,
+                                snapshot.fresh_required, snapshot.misc_received)
+        else:
+            live_index = live_positions[packet_id]
+            counts[:, index] = (live.upper_received[live_index], live.upper_required[live_index],
+                                live.fresh_received[live_index], live.fresh_required[live_index],
+                                live.misc_received[live_index])
+
+    return PacketScores(packet_ids, *counts)
@@ -0,0 +1,79 @@
+"""
+Serves the fingerprinted and precompressed static assets written by build_assets.py
+
+When packet/static/dist/assets.json exists url_for('static', ...) points at the fingerprinted copy of each file, which
+is served with a far future Cache-Control header and as its .br or .gz variant when the browser accepts it. Without the
+manifest (ex. local development without running the build step) the plain files are served as before.
+"""
+
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+
+from packet import app
+
+_manifest_path = os.path.join(app.static_folder, 'dist', 'assets.json')
+
+# Maps original static paths to their fingerprinted paths, and fingerprinted paths to their available encodings
+_fingerprinted = {}
+_encodings = {}
+
+if os.path.exists(_manifest_path):
+    with open(_manifest_path) as manifest_file:
+        for _name, _entry in json.load(manifest_file).items():
+            _fingerprinted[_name] = _entry['path']
+            _encodings[_entry['path']] = _entry['encodings']
+    app.logger.info('Loaded {} fingerprinted static assets'.format(len(_fingerprinted)))
+
+# Fingerprinted files never change so browsers can keep them forever
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# Preferred order when the browser accepts more than one
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def send_precompressed(filename, max_age=None):
+    """
+    Sends a static file, using its precompressed variant if there is one the browser accepts
+    :param filename: The path relative to the static folder. Unfingerprinted names are looked up in the manifest.
+    :param max_age: Overrides the cache lifetime, ex. for service workers that must always be revalidated
+    """
+    # Only the fingerprinted URL is safe to cache forever, the original name still serves whatever the latest build is
+    immutable = filename in _encodings and max_age is None
+    filename = _fingerprinted.get(filename, filename)
+    if max_age is None:
+        max_age = IMMUTABLE_MAX_AGE if immutable else app.get_send_file_max_age(filename)
+
+    available = _encodings.get(filename, [])
+    encoding, extension, mimetype = None, '', None
+    for accepted, variant in _ENCODINGS:
+        if variant in available and accepted in request.accept_encodings:
+            # The variant's own extension would make send_file guess the wrong type
+            encoding, extension = accepted, variant
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            break
+
+    response = send_from_directory(app.static_folder, filename + extension, cache_timeout=max_age, mimetype=mimetype)
+
+    if available:
+        response.vary.add('Accept-Encoding')
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if immutable:
+        response.cache_control.immutable = True
+
+    return response
+
+
+@app.url_defaults
+def fingerprint_static_urls(endpoint, values):
+    """
+    Points url_for('static', filename=...) at the fingerprinted copy of the file
+    """
+    if endpoint == 'static' and values.get('filename') in _fingerprinted:
+        values['filename'] = _fingerprinted[values['filename']]
+
+
+app.view_functions['static'] = send_precompressed
@@ -2,12 +2,13 @@
 General utilities and decorators for supporting the Python logic
 """
 
-from functools import wraps, lru_cache
+from functools import wraps
 
 import requests
 from flask import session, redirect
 
 from packet import auth, app
+from packet.cache import cached
 from packet.models import Freshman
 from packet.ldap import ldap_get_member, ldap_is_intromember
 
@@ -40,12 +41,12 @@ def before_request(func):
     return wrapped_function
 
 
-@lru_cache(maxsize=128)
+@cached('freshman:onfloor')
 def is_freshman_on_floor(rit_username):
     """
     Checks if a freshman is on floor
     """
-    freshman = Freshman.query.filter_by(rit_username=rit_username).first()
+    freshman = Freshman.by_username(rit_username)
     if freshman is not None:
         return freshman.onfloor
     else:
@@ -0,0 +1,34 @@
+"""
+Tests for the logging decorators in packet.log_utils
+"""
+
+import os
+import time
+import unittest
+from unittest import mock
+
+os.environ.setdefault('PACKET_DATABASE_URI', 'sqlite://')
+
+# Importing packet opens the first LDAP connection
+with mock.patch('csh_ldap.CSHLDAP'):
+    from packet import app, log_utils
+
+
+class LogSlowTest(unittest.TestCase):
+    def test_records_positional_arguments(self):
+        @log_utils.log_slow
+        def view(packet_id, uid=None):
+            time.sleep(0.01)
+            return packet_id
+
+        with mock.patch.dict(app.config, SLOW_REQUEST_THRESHOLD=0.001), \
+                mock.patch.object(log_utils, 'slow_requests') as slow_requests, app.app_context():
+            self.assertEqual(view(5, uid='u1'), 5)
+
+        slow_requests.append.assert_called_once()
+        record = slow_requests.append.call_args[0][0]
+        self.assertEqual(record['arguments'], {'0': '5', 'uid': "'u1'"})
+
+
+if __name__ == '__main__':
+    unittest.main()